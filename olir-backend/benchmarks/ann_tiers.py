@@ -0,0 +1,55 @@
+"""
+Recall@k vs latency of the IVF / HNSW index tiers against exact flat search.
+
+    python -m benchmarks.ann_tiers                 # synthetic corpus, 200k x 384
+    python -m benchmarks.ann_tiers --size 500000   # bigger synthetic corpus
+    python -m benchmarks.ann_tiers --from-store    # vectors currently indexed in data/faiss_index
+
+Run from olir-backend/. Use the output to pick VECTOR_ANN_TIER,
+VECTOR_IVF_NPROBE and VECTOR_HNSW_EF_SEARCH for the corpus size you expect.
+"""
+import argparse
+import numpy as np
+from utils.index_factory import compare_index_tiers
+
+
+def synthetic_corpus(size: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Clustered, L2-normalised vectors, closer to sentence embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 500), dim)).astype("float32")
+    vectors = centers[rng.integers(0, len(centers), size)] + 0.35 * rng.normal(size=(size, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--from-store", action="store_true")
+    args = parser.parse_args()
+
+    if args.from_store:
+        from utils.vector_store import get_vector_store
+        snapshot = get_vector_store().snapshot()
+        if snapshot.ntotal == 0:
+            raise SystemExit("No vectors indexed yet.")
+        vectors = snapshot.vectors()
+    else:
+        vectors = synthetic_corpus(args.size + args.queries, args.dim)
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.normal(size=(len(picks), vectors.shape[1])).astype("float32")
+    if not args.from_store:
+        vectors = np.delete(vectors, picks, axis=0)
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, recall@{args.k}\n")
+    print(f"{'tier':<6} {'setting':<14} {'recall':>8} {'ms/query':>10} {'build s':>9}")
+    for row in compare_index_tiers(vectors, queries, k=args.k):
+        print(f"{row['tier']:<6} {row['setting']:<14} {row['recall']:>8.3f} {row['ms_per_query']:>10.3f} {row['build_s']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Memory per million chunks and recall@k of compressed vector storage
+(VECTOR_COMPRESSION = fp16 / sq8 / pq) against raw float32, with and
+without the exact re-rank of the top VECTOR_RERANK_FACTOR * k candidates.
+
+    python -m benchmarks.compression --texts corpus.txt   # embed one chunk per line with utils.embedder (MiniLM)
+    python -m benchmarks.compression --from-store         # MiniLM vectors currently indexed in data/faiss_index
+    python -m benchmarks.compression --size 100000        # synthetic stand-in when no model is available
+
+Run from olir-backend/. PQ needs at least ~10k vectors to train; smaller
+corpora fall back to sq8, shown in the "stored as" column.
+"""
+import argparse
+import numpy as np
+from benchmarks.ann_tiers import synthetic_corpus
+from utils.index_factory import RERANK_FACTOR, compare_compression
+
+
+def embed_texts(path: str) -> np.ndarray:
+    from utils.embedder import get_embeddings
+    with open(path, "r", encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return get_embeddings(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--tier", default="flat", choices=["flat", "ivf", "hnsw"])
+    parser.add_argument("--rerank-factor", type=int, default=RERANK_FACTOR or 4)
+    parser.add_argument("--texts")
+    parser.add_argument("--from-store", action="store_true")
+    args = parser.parse_args()
+
+    if args.texts:
+        vectors = embed_texts(args.texts)
+    elif args.from_store:
+        from utils.vector_store import get_vector_store
+        snapshot = get_vector_store().snapshot()
+        if snapshot.ntotal == 0:
+            raise SystemExit("No vectors indexed yet.")
+        vectors = snapshot.vectors()
+    else:
+        vectors = synthetic_corpus(args.size, args.dim)
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.normal(size=(len(picks), vectors.shape[1])).astype("float32")
+
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, recall@{args.k}, "
+          f"tier {args.tier}, re-rank top {args.rerank_factor * args.k}\n")
+    print(f"{'setting':<8} {'stored as':<10} {'MB/1M':>8} {'recall':>8} {'reranked':>9} {'ms/query':>9} {'build s':>8}")
+    for row in compare_compression(vectors, queries, k=args.k, tier=args.tier, rerank_factor=args.rerank_factor):
+        print(f"{row['compression']:<8} {row['effective'] + '/' + row['tier']:<10} {row['mb_per_million']:>8.0f} "
+              f"{row['recall']:>8.3f} {row['recall_reranked']:>9.3f} {row['ms_per_query']:>9.3f} {row['build_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Throughput, query latency and parity of the embedding backends (EMBED_BACKEND).
+
+    python -m benchmarks.embed_backends
+    python -m benchmarks.embed_backends --file some.pdf --backends torch onnx-int8
+
+Run from olir-backend/. Every backend embeds the same upload chunks; parity
+is the cosine similarity of each embedding to the PyTorch one (1.0 = identical).
+"""
+import argparse
+import os
+import statistics
+import time
+import numpy as np
+from benchmarks.embed_throughput import DEFAULT_FILE
+from routers.upload import build_document_chunks
+from utils.embedder import BACKENDS, load_model
+from utils.processor import extract_text_from_pdf
+
+QUERIES = [
+    "What is the main objective of the project?",
+    "How do I list hidden files in a directory?",
+    "Which database does the system use?",
+    "Summarize the conclusion.",
+    "What command changes file permissions?",
+]
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=DEFAULT_FILE)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--limit", type=int, default=512, help="max texts to embed")
+    args = parser.parse_args()
+
+    text = extract_text_from_pdf(args.file)
+    texts = build_document_chunks(os.path.basename(args.file), text)[0][:args.limit]
+    print(f"{len(texts)} texts from {os.path.basename(args.file)}, {os.cpu_count()} CPUs\n")
+
+    reference = load_model("torch").encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+
+    print(f"{'backend':<10} {'texts/s':>9} {'query p50 ms':>13} {'query p95 ms':>13} {'cos mean':>9} {'cos min':>8}")
+    for backend in args.backends:
+        model = load_model(backend)
+        model.encode(QUERIES)  # warm-up
+
+        start = time.perf_counter()
+        embeddings = model.encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+        throughput = len(texts) / (time.perf_counter() - start)
+
+        latencies = []
+        for _ in range(10):
+            for query in QUERIES:
+                start = time.perf_counter()
+                model.encode([query])
+                latencies.append((time.perf_counter() - start) * 1000)
+        quantiles = statistics.quantiles(latencies, n=20)
+
+        parity = cosine_rows(embeddings, reference)
+        print(f"{backend:<10} {throughput:>9.1f} {statistics.median(latencies):>13.2f} {quantiles[18]:>13.2f} "
+              f"{parity.mean():>9.4f} {parity.min():>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
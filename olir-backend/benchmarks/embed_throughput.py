@@ -0,0 +1,49 @@
+"""
+Ingest embedding throughput: one forward pass per chunk vs utils.embedder.get_embeddings.
+
+    python -m benchmarks.embed_throughput                          # a large reference guide in data/user_docs
+    python -m benchmarks.embed_throughput --file some.pdf --batch-size 32
+
+Run from olir-backend/. Embeds exactly what an upload indexes (chunks,
+headings and definitions, see routers.upload.build_document_chunks).
+"""
+import argparse
+import os
+import time
+from routers.upload import build_document_chunks
+from utils.embedder import get_embeddings, get_model
+from utils.processor import extract_text_from_pdf
+
+DEFAULT_FILE = "data/user_docs/Red_Hat_Enterprise_Linux-4-Reference_Guide-en-US.pdf"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=DEFAULT_FILE)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.file.lower().endswith(".pdf"):
+        text = extract_text_from_pdf(args.file)
+    else:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    texts, _ = build_document_chunks(os.path.basename(args.file), text)
+    print(f"{len(texts)} texts from {os.path.basename(args.file)}, {os.cpu_count()} CPUs\n")
+
+    model = get_model()
+    start = time.perf_counter()
+    for text in texts:
+        model.encode([text])
+    one_by_one = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_embeddings(texts, batch_size=args.batch_size)
+    batched = time.perf_counter() - start
+
+    print(f"one at a time  {len(texts) / one_by_one:8.1f} texts/s")
+    print(f"batched        {len(texts) / batched:8.1f} texts/s  ({one_by_one / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Local stand-in for the OpenRouter chat-completions endpoint, for running
+the backend offline and for load tests.
+
+    uvicorn benchmarks.fake_openrouter:app --port 8819
+    OPENROUTER_URL=http://127.0.0.1:8819/api/v1/chat/completions python main.py
+
+FAKE_LLM_LATENCY_MS sets how long each completion takes (default 300),
+plus FAKE_LLM_MS_PER_1K_PROMPT_TOKENS per 1000 prompt tokens (default 0)
+to model prefill time growing with the prompt. With `stream: true` that is
+the time to the first token, and each further word follows
+FAKE_LLM_TOKEN_MS later (default 20), as OpenRouter's SSE.
+
+Provider trouble, for exercising retries, hedging and the circuit breaker:
+FAKE_LLM_ERROR_RATE of requests fail with FAKE_LLM_ERROR_STATUS (default
+503), and FAKE_LLM_SLOW_RATE of them take FAKE_LLM_SLOW_MS (default 5000)
+instead of the normal latency.
+
+The reply echoes the last user message, so answers are easy to check;
+requests for `response_format: json_object` get it wrapped in a JSON analysis.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "20"))
+PROMPT_MS_PER_1K = float(os.getenv("FAKE_LLM_MS_PER_1K_PROMPT_TOKENS", "0"))
+ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+ERROR_STATUS = int(os.getenv("FAKE_LLM_ERROR_STATUS", "503"))
+SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+SLOW_MS = float(os.getenv("FAKE_LLM_SLOW_MS", "5000"))
+
+app = FastAPI()
+
+
+def fake_reply(payload: dict) -> str:
+    messages = payload.get("messages") or [{"content": ""}]
+    question = messages[-1].get("content", "").rsplit("USER QUESTION:", 1)[-1].strip().splitlines()[0:1]
+    reply = f"Stand-in answer to: {question[0] if question else ''}"
+    if (payload.get("response_format") or {}).get("type") == "json_object":
+        return json.dumps({"summary": reply, "key_points": [], "table_of_contents": []})
+    return reply
+
+
+def latency(payload: dict) -> float:
+    """Seconds before the first token: fixed latency plus time proportional to the prompt (~4 characters per token)."""
+    if random.random() < SLOW_RATE:
+        return SLOW_MS / 1000
+    prompt_chars = sum(len(m.get("content", "")) for m in payload.get("messages") or [])
+    return (LATENCY_MS + PROMPT_MS_PER_1K * prompt_chars / 4000) / 1000
+
+
+async def stream_reply(payload: dict, completion_id: str):
+    yield ": OPENROUTER PROCESSING\n\n"
+    await asyncio.sleep(latency(payload))
+    words = fake_reply(payload).split(" ")
+    for n, word in enumerate(words):
+        if n:
+            await asyncio.sleep(TOKEN_MS / 1000)
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "delta": {"content": word if n == 0 else " " + word}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    completion_id = f"gen-{uuid.uuid4().hex[:12]}"
+    if random.random() < ERROR_RATE:
+        return JSONResponse({"error": {"code": ERROR_STATUS, "message": "Injected failure"}}, status_code=ERROR_STATUS)
+    if payload.get("stream"):
+        return StreamingResponse(stream_reply(payload, completion_id), media_type="text/event-stream")
+    await asyncio.sleep(latency(payload))
+    reply = fake_reply(payload)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(reply.split()), "total_tokens": len(reply.split())}
+    }
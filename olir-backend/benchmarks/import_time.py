@@ -0,0 +1,57 @@
+"""
+Import-time cost of the server and of the heavy libraries it now loads lazily.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 5
+
+Run from olir-backend/. Each measurement is a fresh interpreter, so nothing
+is shared between runs; "pulled in" lists heavy modules that `import main`
+still loaded eagerly (should be empty).
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY = ("sentence_transformers", "torch", "faiss", "PyPDF2")
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed)
+# Modules registered by utils.lazy.lazy_import stay _LazyModule until first used
+print("loaded:" + ",".join(m for m in {heavy!r} if m in sys.modules and type(sys.modules[m]).__name__ != "_LazyModule"))
+"""
+
+
+def measure(module: str):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    seconds, loaded = result.stdout.strip().splitlines()[-2:]
+    return float(seconds), loaded[len("loaded:"):]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'import':<24} {'median s':>9}  pulled in")
+    for module in ("main",) + HEAVY:
+        runs = [measure(module) for _ in range(args.repeat)]
+        times = [seconds for seconds, _ in runs if seconds is not None]
+        if not times:
+            print(f"{module:<24} {'-':>9}  not importable: {runs[0][1]}")
+            continue
+        loaded = runs[0][1] if module == "main" else ""
+        print(f"{module:<24} {statistics.median(times):>9.3f}  {loaded}")
+
+
+if __name__ == "__main__":
+    main()
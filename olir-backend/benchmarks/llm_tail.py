@@ -0,0 +1,66 @@
+"""
+Chat-completion latency percentiles and error rate through utils.llm_client
+against a misbehaving provider, with the tail-latency controls on or off.
+
+    FAKE_LLM_ERROR_RATE=0.05 FAKE_LLM_SLOW_RATE=0.03 uvicorn benchmarks.fake_openrouter:app --port 8819
+    OPENROUTER_URL=http://127.0.0.1:8819/api/v1/chat/completions python -m benchmarks.llm_tail
+
+Run from olir-backend/. "baseline" makes one attempt with no deadline;
+"retries" adds the deadline and jittered retries; "hedged" also hedges
+after the observed p95.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from utils import llm_client
+
+PAYLOAD = {"model": "fake", "messages": [{"role": "user", "content": "USER QUESTION: ping"}], "max_tokens": 10}
+
+
+async def run(mode: str, calls: int, concurrency: int, deadline: float):
+    llm_client.MAX_RETRIES = 0 if mode == "baseline" else 2
+    llm_client.HEDGE_ENABLED = mode == "hedged"
+    llm_client._breaker = llm_client.CircuitBreaker(failures=10 ** 6)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    # Fill the latency window the hedging delay is derived from
+    await asyncio.gather(*(llm_client.chat_completion(PAYLOAD) for _ in range(llm_client.HEDGE_MIN_SAMPLES)), return_exceptions=True)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await llm_client.chat_completion(PAYLOAD, deadline=deadline if mode != "baseline" else 3600)
+            except llm_client.LLMError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    q = statistics.quantiles(latencies, n=100)
+    return q[49], q[94], q[98], errors / calls
+
+
+async def main_async(args):
+    print(f"{args.calls} calls, {args.concurrency} in flight, deadline {args.deadline}s\n")
+    print(f"{'mode':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes:
+        p50, p95, p99, error_rate = await run(mode, args.calls, args.concurrency, args.deadline)
+        print(f"{mode:>9} {p50:>8.0f} {p95:>8.0f} {p99:>8.0f} {error_rate:>7.1%}")
+    print(f"\n{llm_client.get_stats()}")
+    await llm_client.close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--deadline", type=float, default=10)
+    parser.add_argument("--modes", nargs="+", default=["baseline", "retries", "hedged"])
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Offline load test: the FastAPI app from main.py against the local OpenRouter
+stand-in (benchmarks/fake_openrouter.py), driven by concurrent simulated users.
+
+    python -m benchmarks.load
+    python -m benchmarks.load --users 50 --duration 60 --mix chat=3 stream=1
+    python -m benchmarks.load --llm-latency-ms 800 --llm-error-rate 0.05 --save baseline.json
+    python -m benchmarks.load --compare baseline.json --app-env ANSWER_CACHE=0 LLM_HEDGE=1
+
+Run from olir-backend/. Both servers are started as subprocesses on free
+ports. The app runs in a scratch copy of data/, so chat sessions and
+uploads never touch the real one; pass --app-url to load an already running
+server instead. Questions are built from the headings of the PDFs bundled
+in data/user_docs plus a few general ones. With --ingest those PDFs are
+uploaded (and asked about by name) before the measured run.
+
+Each user loops until --duration is over: pick an endpoint from --mix, send
+one request, wait --think-ms. The report has requests/s, error rate and
+p50/p95/p99 latency per endpoint, time to first token for /chat/stream, and
+the share of answers served from the answer cache. Uploads are reported
+twice: /upload is the time until the job is accepted, "/upload (trained)"
+until its ingest job has finished. --save writes it as JSON
+to compare later runs against with --compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import httpx
+from utils.processor import extract_key_information
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCS_DIR = os.path.join(BACKEND_DIR, "data", "user_docs")
+# Only the first pages are read for questions; full extraction of a large manual takes a minute
+QUESTION_PAGES = 30
+
+GENERAL_QUESTIONS = [
+    "What are the basic Linux commands for working with files?",
+    "How do I list all files in a directory?",
+    "Explain how file permissions work.",
+    "What commands are used to manage processes?",
+    "How do I search for text inside files?",
+    "What is the purpose of the /etc directory?",
+    "Describe the boot process.",
+    "Which commands show disk usage?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_questions(limit: int = 40) -> list:
+    """(question, doc_name) pairs: general questions plus one per heading found in the bundled PDFs."""
+    from PyPDF2 import PdfReader
+    questions = [(q, None) for q in GENERAL_QUESTIONS]
+    for name in sorted(os.listdir(DOCS_DIR)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        reader = PdfReader(os.path.join(DOCS_DIR, name))
+        text = "\n".join(page.extract_text() or "" for page in reader.pages[:QUESTION_PAGES])
+        headings = [h for h in extract_key_information(text)["headings"] if 4 <= len(h) <= 60]
+        for heading in headings[:limit // 2]:
+            questions.append((f"What does the document say about {heading.strip().rstrip('.:')}?", name))
+    return questions
+
+
+def start_servers(args):
+    """Start the fake provider and the app; returns (app_url, processes, scratch dir)."""
+    fake_port, app_port = free_port(), free_port()
+    fake_env = {
+        **os.environ,
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_TOKEN_MS": str(args.llm_token_ms),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "FAKE_LLM_SLOW_RATE": str(args.llm_slow_rate),
+    }
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.fake_openrouter:app", "--port", str(fake_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=fake_env
+    )
+
+    workdir = tempfile.mkdtemp(prefix="olir-load-")
+    shutil.copytree(os.path.join(BACKEND_DIR, "data"), os.path.join(workdir, "data"),
+                    ignore=shutil.ignore_patterns("chat_history"))
+    os.makedirs(os.path.join(workdir, "data", "chat_history"), exist_ok=True)
+    app_env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "OPENROUTER_URL": f"http://127.0.0.1:{fake_port}/api/v1/chat/completions",
+        "OPENROUTER_API_KEY": "load-test",
+        **dict(item.split("=", 1) for item in args.app_env),
+    }
+    log = open(os.path.join(workdir, "app.log"), "w")
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=workdir, env=app_env, stdout=log, stderr=subprocess.STDOUT
+    )
+    return f"http://127.0.0.1:{app_port}", [fake, app], workdir
+
+
+def wait_until_up(app_url: str, wait_ready: float):
+    deadline = time.time() + 60
+    while True:
+        try:
+            httpx.get(f"{app_url}/status/llm", timeout=2)
+            break
+        except httpx.TransportError:
+            if time.time() > deadline:
+                raise SystemExit(f"App did not start at {app_url}")
+            time.sleep(0.5)
+    # Wait for the model and index warm-up so the first requests do not measure it
+    deadline = time.time() + wait_ready
+    while True:
+        ready = httpx.get(f"{app_url}/ready", timeout=5)
+        if ready.status_code == 200:
+            return
+        if time.time() > deadline:
+            print(f"⚠️ App not ready after {wait_ready:.0f}s, measuring anyway: {ready.json()}")
+            return
+        time.sleep(1)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, endpoint: str, seconds: float, ok: bool, ttft: float = None, cached: bool = False):
+        self.samples.setdefault(endpoint, []).append((seconds, ok, ttft, cached))
+
+    def report(self, elapsed: float) -> dict:
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [s * 1000 for s, ok, _, _ in samples if ok]
+            ttfts = [t * 1000 for _, ok, t, _ in samples if ok and t is not None]
+            row = {
+                "requests": len(samples),
+                "rps": round(len(samples) / elapsed, 2),
+                "error_rate": round(1 - len(latencies) / len(samples), 4),
+                "cached": round(sum(c for _, _, _, c in samples) / len(samples), 4),
+            }
+            row.update(_percentiles("latency", latencies))
+            row.update(_percentiles("ttft", ttfts))
+            report[endpoint] = row
+        return report
+
+
+def _percentiles(name: str, values: list) -> dict:
+    if len(values) < 2:
+        return {}
+    q = statistics.quantiles(values, n=100)
+    return {f"{name}_p50_ms": round(q[49], 1), f"{name}_p95_ms": round(q[94], 1), f"{name}_p99_ms": round(q[98], 1)}
+
+
+def answered(reply: str) -> bool:
+    """Whether a reply is an answer, not a "❌ No data" or "⚠️" failure message (both chat endpoints send these)."""
+    return not reply.startswith(("❌", "⚠️"))
+
+
+async def ask(client, recorder, question, doc_name):
+    body = {"message": question, "doc_name": doc_name}
+    start = time.perf_counter()
+    try:
+        response = await client.post("/chat", json=body)
+        data = response.json()
+        ok = response.status_code == 200 and answered(data.get("reply", ""))
+        recorder.add("/chat", time.perf_counter() - start, ok, cached=bool(data.get("cached")))
+    except (httpx.HTTPError, ValueError):
+        recorder.add("/chat", time.perf_counter() - start, False)
+
+
+async def ask_stream(client, recorder, question, doc_name):
+    body = {"message": question, "doc_name": doc_name}
+    start = time.perf_counter()
+    ttft, ok, cached, event = None, False, False, None
+    try:
+        async with client.stream("POST", "/chat/stream", json=body) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    if event == "token" and ttft is None:
+                        ttft = time.perf_counter() - start
+                    elif event == "done":
+                        done = json.loads(line[len("data:"):])
+                        ok = answered(done.get("reply", ""))
+                        cached = bool(done.get("cached"))
+    except (httpx.HTTPError, ValueError):
+        ok = False
+    recorder.add("/chat/stream", time.perf_counter() - start, ok, ttft=ttft, cached=cached)
+
+
+async def upload(client, recorder, path) -> str:
+    """Upload a PDF under a unique name and wait for its ingest job; returns that name once it is trained."""
+    name = f"loadtest_{uuid.uuid4().hex[:8]}_{os.path.basename(path)}"
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            response = await client.post("/upload", files={"file": (name, f, "application/pdf")})
+        recorder.add("/upload", time.perf_counter() - start, response.status_code == 202)
+        if response.status_code != 202:
+            return
+        # Training runs as a background job; poll it to time the whole ingest
+        job_url = response.json()["status_url"]
+        while True:
+            await asyncio.sleep(0.25)
+            job = (await client.get(job_url)).json()
+            if job["status"] in ("completed", "failed"):
+                recorder.add("/upload (trained)", time.perf_counter() - start, job["status"] == "completed")
+                return name if job["status"] == "completed" else None
+    except (httpx.HTTPError, ValueError, KeyError):
+        recorder.add("/upload", time.perf_counter() - start, False)
+
+
+async def run_load(app_url: str, args, questions: list) -> dict:
+    actions = {
+        "chat": lambda client, recorder: ask(client, recorder, *random.choice(questions)),
+        "stream": lambda client, recorder: ask_stream(client, recorder, *random.choice(questions)),
+        "upload": lambda client, recorder: upload(client, recorder, random.choice(args.upload_files)),
+    }
+    mix = dict(item.split("=") for item in args.mix)
+    names = list(mix)
+    weights = [float(mix[name]) for name in names]
+    recorder = Recorder()
+
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout, limits=limits) as client:
+        if args.ingest:
+            print(f"Ingesting {len(args.upload_files)} documents...")
+            setup = Recorder()
+            uploaded = {os.path.basename(path): await upload(client, setup, path) for path in args.upload_files}
+            # Ask about each document under the name it was uploaded as; unfiltered if it was not
+            questions = [(question, uploaded.get(doc_name)) for question, doc_name in questions]
+
+        stop = time.perf_counter() + args.duration
+
+        async def user(n):
+            # Stagger the start so the first second is not one synchronized burst
+            await asyncio.sleep(random.uniform(0, args.think_ms / 1000))
+            while time.perf_counter() < stop:
+                name = random.choices(names, weights)[0]
+                await actions[name](client, recorder)
+                await asyncio.sleep(random.uniform(0.5, 1.5) * args.think_ms / 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(n) for n in range(args.users)))
+        return recorder.report(time.perf_counter() - start)
+
+
+def print_report(report: dict, baseline: dict = None):
+    columns = ["requests", "rps", "error_rate", "cached", "latency_p50_ms", "latency_p95_ms", "latency_p99_ms",
+               "ttft_p50_ms", "ttft_p95_ms"]
+    print(f"\n{'endpoint':<18}" + "".join(f"{c.replace('latency_', '').replace('_ms', ' ms'):>14}" for c in columns))
+    for endpoint, row in report.items():
+        print(f"{endpoint:<18}" + "".join(f"{_cell(c, row.get(c)):>14}" for c in columns))
+        if baseline and endpoint in baseline:
+            old = baseline[endpoint]
+            print(f"{'  vs baseline':<18}" + "".join(f"{_delta(row.get(c), old.get(c)):>14}" for c in columns))
+
+
+def _cell(column, value):
+    if value is None:
+        return "-"
+    return f"{value:.1%}" if column in ("error_rate", "cached") else f"{value:g}"
+
+
+def _delta(new, old):
+    if new is None or old is None or not old:
+        return ""
+    return f"{(new - old) / old:+.0%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--think-ms", type=float, default=500, help="pause between a user's requests")
+    parser.add_argument("--mix", nargs="+", default=["chat=3", "stream=1"],
+                        help="endpoint weights, from chat, stream and upload")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--ingest", action="store_true", help="upload the bundled PDFs before the run")
+    parser.add_argument("--upload-files", nargs="+",
+                        default=[os.path.join(DOCS_DIR, f) for f in sorted(os.listdir(DOCS_DIR)) if f.lower().endswith(".pdf")])
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-token-ms", type=float, default=20)
+    parser.add_argument("--llm-error-rate", type=float, default=0)
+    parser.add_argument("--llm-slow-rate", type=float, default=0)
+    parser.add_argument("--app-env", nargs="+", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app, e.g. ANSWER_CACHE=0 to measure uncached answers")
+    parser.add_argument("--app-url", help="load this running server instead of starting one")
+    parser.add_argument("--wait-ready", type=float, default=300, help="seconds to wait for /ready")
+    parser.add_argument("--save", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="print deltas against a report saved with --save")
+    args = parser.parse_args()
+
+    questions = build_questions()
+    if not args.ingest:
+        # Documents that are not indexed cannot be filtered on
+        questions = [(question, None) for question, _ in questions]
+    print(f"{len(questions)} questions, {args.users} users, {args.duration:.0f}s, mix {' '.join(args.mix)}")
+
+    processes, workdir = [], None
+    app_url = args.app_url
+    try:
+        if not app_url:
+            app_url, processes, workdir = start_servers(args)
+            print(f"Fake provider: {args.llm_latency_ms:.0f}ms latency, {args.llm_error_rate:.0%} errors, "
+                  f"{args.llm_slow_rate:.0%} slow; app at {app_url}")
+        wait_until_up(app_url, args.wait_ready)
+        report = asyncio.run(run_load(app_url, args, questions))
+        llm_stats = httpx.get(f"{app_url}/status/llm").json()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+    print_report(report, baseline)
+    print(f"\nLLM client: {llm_stats}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+                       "endpoints": report, "llm": llm_stats}, f, indent=2)
+        print(f"Saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
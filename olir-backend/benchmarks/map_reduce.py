@@ -0,0 +1,61 @@
+"""
+Answer-generation wall-clock: one extraction over the whole context versus
+map-reduce extraction over parallel groups, each followed by one synthesis.
+
+    uvicorn benchmarks.fake_openrouter:app --port 8819   # FAKE_LLM_MS_PER_1K_PROMPT_TOKENS=400
+    OPENROUTER_URL=http://127.0.0.1:8819/api/v1/chat/completions python -m benchmarks.map_reduce
+
+Run from olir-backend/. The context is the first `--chunks` chunks of a
+PDF, formatted as enhance_context_for_query sections. Against the real
+provider set OPENROUTER_API_KEY instead of OPENROUTER_URL.
+"""
+import argparse
+import asyncio
+import time
+from utils import answer_generator
+from utils.answer_generator import extract_facts_from_context, generate_answer, synthesize_answer_from_facts
+from utils.context_enhancer import count_tokens
+from utils.processor import extract_text_from_pdf, smart_chunk_text
+
+DEFAULT_FILE = "data/user_docs/Red_Hat_Enterprise_Linux-4-Reference_Guide-en-US.pdf"
+QUESTION = "List all the commands mentioned in the document."
+
+
+async def sequential(context: str) -> float:
+    start = time.perf_counter()
+    facts = await extract_facts_from_context(context, QUESTION)
+    await synthesize_answer_from_facts(facts, QUESTION)
+    return time.perf_counter() - start
+
+
+async def map_reduce(context: str) -> float:
+    start = time.perf_counter()
+    await generate_answer(context, QUESTION)
+    return time.perf_counter() - start
+
+
+async def run(chunks, sizes):
+    print(f"{'chunks':>6} {'tokens':>7} {'groups':>6} {'sequential s':>13} {'map-reduce s':>13}")
+    for n in sizes:
+        context = "\n\n".join(f"=== DOCUMENT SECTION {i+1} ===\n{chunk}" for i, chunk in enumerate(chunks[:n]))
+        groups = len(answer_generator.split_context(context))
+        seq = await sequential(context)
+        mr = await map_reduce(context)
+        print(f"{n:>6} {count_tokens(context):>7} {groups:>6} {seq:>13.2f} {mr:>13.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=DEFAULT_FILE)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[6, 12, 24, 48])
+    args = parser.parse_args()
+
+    chunks = smart_chunk_text(extract_text_from_pdf(args.file), chunk_size=1200, overlap=200)
+    # Force map-reduce for every size so the two modes are compared like for like
+    answer_generator.MAP_REDUCE_MIN_TOKENS = 0
+    # One event loop for all runs: the shared LLM client belongs to the loop that created it
+    asyncio.run(run(chunks, args.chunks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Query-embedding throughput and latency with and without micro-batching.
+
+    python -m benchmarks.query_batching
+    python -m benchmarks.query_batching --concurrency 64 --windows 0 2 5 10
+
+Run from olir-backend/. Fires `--queries` unique questions at the embedding
+pool with `--concurrency` in flight, once per batching window (0 = one
+forward pass per query). Queries are unique so the embedding cache never hits.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from utils.embed_pool import QUERY_MAX_BATCH, EmbedPool, QueryBatcher
+from utils.embedder import get_model
+
+
+async def run(window_ms: float, max_batch: int, queries: int, concurrency: int):
+    batcher = QueryBatcher(EmbedPool(), window_ms=window_ms, max_batch=max_batch)
+    semaphore = asyncio.Semaphore(concurrency)
+    tag = uuid.uuid4().hex[:8]
+    latencies = []
+
+    async def one(n):
+        async with semaphore:
+            start = time.perf_counter()
+            await batcher.embed(f"What does section {n} of the report say about topic {tag}?")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(queries)))
+    elapsed = time.perf_counter() - start
+    return queries / elapsed, statistics.median(latencies), statistics.quantiles(latencies, n=100)[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-batch", type=int, default=QUERY_MAX_BATCH)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10])
+    args = parser.parse_args()
+
+    get_model().encode(["warm up"])
+    print(f"{args.queries} queries, {args.concurrency} in flight, max batch {args.max_batch}\n")
+    print(f"{'window ms':>9} {'queries/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for window in args.windows:
+        qps, p50, p99 = asyncio.run(run(window, args.max_batch, args.queries, args.concurrency))
+        print(f"{window:>9.1f} {qps:>10.1f} {p50:>8.1f} {p99:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
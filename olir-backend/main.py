@@ -1,7 +1,9 @@
 from fastapi import FastAPI, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from routers import chat, upload, history
-from routers import training_history
+from routers import training_history, status
+from utils.llm_client import close_client
+from utils.warmup import WARMUP_ON_STARTUP, start_warm_up
 import uvicorn
 
 app = FastAPI()
@@ -20,6 +22,27 @@ app.include_router(chat.router)
 app.include_router(upload.router)
 app.include_router(history.router)
 app.include_router(training_history.router)
+app.include_router(status.router)
+
+@app.on_event("startup")
+def warm_up_in_background():
+    # The port binds right away; /ready reports when the model and index are hot
+    if WARMUP_ON_STARTUP:
+        start_warm_up()
+
+@app.on_event("startup")
+async def start_ingest_workers():
+    # Also picks up uploads a previous run had not finished training
+    upload.ingest_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    # Jobs cut short stay in the ledger and are re-run on the next start
+    await upload.ingest_jobs.stop()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await close_client()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8818)
\ No newline at end of file
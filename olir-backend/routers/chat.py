@@ -1,22 +1,28 @@
 import os
-import requests
 import json
-import numpy as np
 from dotenv import load_dotenv
 from fastapi import APIRouter, Query, Request
-from utils.embedder import get_embedding
-from utils.vector_store import load_faiss_index
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from utils.embed_pool import embed_query
+from utils.vector_store import get_vector_store
 from utils.chat_memory import save_chat_session, load_all_sessions, load_session_by_id, add_message_to_session
 from models.schemas import ChatSession, Message
-from utils.context_enhancer import enhance_context_for_query
+from utils.context_enhancer import count_tokens, enhance_context_for_query
+from utils.answer_cache import CachedAnswer, answer_cache
+from utils.single_flight import SingleFlight, normalize_question
+from utils.llm_client import LLMError, chat_completion, stream_completion
 from datetime import datetime
+import random
 import uuid
 
 load_dotenv()
 router = APIRouter()
 
-OPENROUTER_API_KEY = "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"
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "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")
+
+# Identical questions asked at the same moment share one retrieval + LLM call
+in_flight = SingleFlight()
 
 def is_document_related_query(message: str) -> bool:
     """Check if the user query is related to document content"""
@@ -62,245 +68,343 @@ def is_greeting(message: str) -> bool:
     ]
     return message_lower in casual_patterns or (any(pattern == message_lower for pattern in casual_patterns))
 
+NON_DOCUMENT_REPLY = "I can only answer questions based on your uploaded documents. Please ask about the content in your PDFs."
+
+SYSTEM_INSTRUCTION = (
+    "You are a helpful document analysis assistant. Your task is to provide accurate and COMPREHENSIVE answers based on the provided document context.\n\n"
+    "INSTRUCTIONS:\n"
+    "1. Use ALL relevant information from the provided context.\n"
+    "2. If the answer is present in the context, provide it clearly.\n"
+    "3. If the answer is not directly in the context, but you can infer it from the context, do so and explain your reasoning.\n"
+    "4. If the answer truly cannot be found, say: 'The provided document does not contain specific information about [topic]'.\n"
+    "5. Include examples, details, and references from the document when available.\n"
+    "6. If multiple sections are relevant, combine them in your answer.\n"
+    "7. Be precise and specific.\n\n"
+    "Format your response as:\n"
+    "- Direct comprehensive answer using ALL relevant information from context\n"
+    "- Include specific examples and syntax when available\n"
+    "- Reference page/section numbers if mentioned in context"
+)
+
+async def parse_chat_request(request: Request, message, session_id, doc_name):
+    """Accept both the query-parameter format (frontend) and the JSON body formats. Returns (message, session_id, doc_name, error)."""
+    # Handle query parameter format (from frontend)
+    if not message:
+        # Handle JSON body format
+        try:
+            body = await request.json()
+        except ValueError:
+            return None, None, None, "❌ Invalid request format"
+        if not isinstance(body, dict):
+            return None, None, None, "❌ Invalid request format"
+
+        # Handle different request formats
+        if "message" in body:
+            # Simple message format
+            message = body["message"]
+        elif "messages" in body:
+            # Messages array format
+            messages = body["messages"]
+            message = messages[-1]["content"] if messages else ""
+        else:
+            return None, None, None, "❌ Invalid request format"
+        doc_name = body.get("doc_name")
+        session_id = body.get("session_id")
+
+    if not message:
+        return None, None, None, "❌ No message provided"
+    return message, session_id, doc_name, None
+
+def start_turn(message: str, session_id: str, doc_name: str) -> str:
+    """Create the chat session if needed and save the user message. Returns the session id."""
+    if not session_id:
+        # Create new session if none exists
+        session_id = str(uuid.uuid4())
+        session = ChatSession(
+            id=session_id,
+            title=f"Chat Session {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+            messages=[],
+            document_id=doc_name
+        )
+        save_chat_session(session)
+
+    # Save user message to session
+    user_message = Message(
+        role="user",
+        content=message,
+        timestamp=datetime.now()
+    )
+    add_message_to_session(session_id, user_message)
+    return session_id
+
+def save_reply(session_id: str, content: str):
+    assistant_message = Message(
+        role="assistant",
+        content=content,
+        timestamp=datetime.now()
+    )
+    add_message_to_session(session_id, assistant_message)
+
+def canned_reply(message: str):
+    """The reply for greetings and non-document questions, which never reach retrieval or the LLM; None otherwise."""
+    # Friendly greeting logic
+    if is_greeting(message):
+        friendly_greetings = [
+            "Hello! How can I help you today?",
+            "Hi there! What would you like to know from your documents?",
+            "Hey! I'm here to assist you with your study materials.",
+            "Greetings! Ask me anything about your uploaded PDFs."
+        ]
+        return random.choice(friendly_greetings)
+
+    # Check if the query is document-related
+    if not is_document_related_query(message):
+        return NON_DOCUMENT_REPLY
+    return None
+
+def retrieve_context(message: str, doc_name: str, query_embedding):
+    """Search the index and pick the chunks to answer from. Returns the selected SearchHits (empty if nothing is indexed)."""
+    # Search the resident vector store for the most relevant chunks (get more candidates for comprehensive results)
+    results = get_vector_store().search(query_embedding, k=12, doc_filter=doc_name)
+    if not results:
+        return []
+
+    # Improved relevance filtering with dynamic threshold
+    relevant_hits = []
+    chunk_scores = []
+
+    for hit in results:
+        # Calculate relevance score (lower distance = higher relevance)
+        relevance_score = 1.0 / (1.0 + hit.distance)
+        chunk_scores.append((hit, relevance_score, hit.distance))
+
+    # Sort by relevance score and filter by adaptive threshold
+    chunk_scores.sort(key=lambda x: x[1], reverse=True)
+
+    # Special handling for comprehensive queries (like "what are linux commands")
+    is_comprehensive_query = any(word in message.lower() for word in ['what are', 'list all', 'show all', 'all the', 'commands'])
+
+    # Make the search more inclusive
+    if is_comprehensive_query:
+        threshold = 0.2  # Lower threshold for more inclusive results
+        max_chunks = 12   # More chunks for comprehensive answers
+    else:
+        if chunk_scores:
+            best_score = chunk_scores[0][1]
+            threshold = best_score * 0.4  # More lenient than before
+        else:
+            threshold = 0.3
+        max_chunks = 8
+
+    for hit, score, distance in chunk_scores:
+        if score >= threshold and distance < 3.0:  # More lenient distance threshold
+            relevant_hits.append(hit)
+        if len(relevant_hits) >= max_chunks:
+            break
+
+    # If no chunks meet threshold, take the best ones
+    if not relevant_hits:
+        relevant_hits = [hit for hit, _, _ in chunk_scores[:max_chunks]]
+
+    return relevant_hits[:max_chunks]
+
+async def current_corpus_version() -> int:
+    """The index's corpus version; the first read loads the index, so it happens off the event loop"""
+    store = get_vector_store()
+    if store.is_loaded():
+        return store.corpus_version
+    return await run_in_threadpool(lambda: store.corpus_version)
+
+def no_results_reply(doc_name: str) -> str:
+    return f"❌ No data available for document: {doc_name}" if doc_name else "❌ No documents have been trained yet."
+
+def build_payload(message: str, selected_chunks) -> dict:
+    # Prepare enhanced context with better formatting and query-specific ordering
+    context = enhance_context_for_query(selected_chunks, message)
+    messages = [
+        {"role": "system", "content": SYSTEM_INSTRUCTION},
+        {"role": "user", "content": f"DOCUMENT CONTEXT:\n{context}\n\nUSER QUESTION: {message}\n\nPlease provide an accurate answer based solely on the document context above."}
+    ]
+    print(f"📏 Prompt tokens: {sum(count_tokens(m['content']) for m in messages)}")
+    return {
+        "model": "mistralai/mistral-small-3.2-24b-instruct:free",  # Better model for accuracy
+        "messages": messages,
+        "temperature": 0.1,  # Lower temperature for more consistent, accurate responses
+        "max_tokens": 1000
+    }
+
+def hit_source(hit) -> dict:
+    """What the client is told about a chunk used as context."""
+    return {
+        "doc_name": hit.metadata.get("doc_name"),
+        "page": hit.metadata.get("page"),
+        "chunk": hit.metadata.get("chunk"),
+        "distance": round(hit.distance, 4)
+    }
+
+async def answer_question(message: str, doc_name: str) -> dict:
+    """
+    Retrieval and the LLM call for one question: the /chat response without
+    the session, shared by every request coalesced onto it.
+    """
+    # Embed the user question on the embedding pool (ahead of ingestion, batched with concurrent queries)
+    query_embedding = await embed_query(message)
+
+    # Read the corpus version before retrieval so the answer is cached under the corpus it was built from
+    corpus_version = await current_corpus_version()
+    cached = answer_cache.get(query_embedding, doc_name, corpus_version)
+    if cached:
+        return {"reply": cached.reply, "context_used": cached.context_used, "cached": True}
+
+    # FAISS search and the chunk fetch from SQLite run off the event loop
+    hits = await run_in_threadpool(retrieve_context, message, doc_name, query_embedding)
+    if not hits:
+        return {"reply": no_results_reply(doc_name)}
+
+    selected_chunks = [hit.text for hit in hits]
+    payload = build_payload(message, selected_chunks)
+
+    try:
+        data = await chat_completion(payload, api_key=OPENROUTER_API_KEY)
+    except LLMError as e:
+        return {"reply": f"⚠️ LLM provider error {e.status_code}", "error": e.body}
+
+    reply = data["choices"][0]["message"]["content"].strip()
+    answer_cache.put(query_embedding, doc_name, corpus_version,
+                     CachedAnswer(message, reply, selected_chunks, [hit_source(hit) for hit in hits]))
+    return {"reply": reply, "context_used": selected_chunks, "cached": False}
+
 @router.post("/chat")
-async def chat_endpoint(request: Request, message: str = Query(None), session_id: str = Query(None)):
+async def chat_endpoint(request: Request, message: str = Query(None), session_id: str = Query(None), doc_name: str = Query(None)):
     """Main chat endpoint that handles both simple messages and document-filtered queries"""
     try:
-        # Handle query parameter format (from frontend)
-        if message:
-            doc_name = None
-        else:
-            # Handle JSON body format
-            body = await request.json()
-            
-            # Handle different request formats
-            if "message" in body:
-                # Simple message format
-                message = body["message"]
-                doc_name = body.get("doc_name")
-                session_id = body.get("session_id")
-            elif "messages" in body:
-                # Messages array format
-                messages = body["messages"]
-                message = messages[-1]["content"] if messages else ""
-                doc_name = body.get("doc_name")
-                session_id = body.get("session_id")
-            else:
-                return {"reply": "❌ Invalid request format"}
-
-        if not message:
-            return {"reply": "❌ No message provided"}
-
-        # Handle chat session
-        if not session_id:
-            # Create new session if none exists
-            session_id = str(uuid.uuid4())
-            session = ChatSession(
-                id=session_id,
-                title=f"Chat Session {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
-                messages=[],
-                document_id=doc_name
-            )
-            save_chat_session(session)
-        
-        # Save user message to session
-        user_message = Message(
-            role="user",
-            content=message,
-            timestamp=datetime.now()
-        )
-        add_message_to_session(session_id, user_message)
-
-        # NEW: Friendly greeting logic
-        if is_greeting(message):
-            friendly_greetings = [
-                "Hello! How can I help you today?",
-                "Hi there! What would you like to know from your documents?",
-                "Hey! I'm here to assist you with your study materials.",
-                "Greetings! Ask me anything about your uploaded PDFs."
-            ]
-            import random
-            reply = random.choice(friendly_greetings)
-            assistant_message = Message(
-                role="assistant",
-                content=reply,
-                timestamp=datetime.now()
-            )
-            add_message_to_session(session_id, assistant_message)
-            return {"reply": reply, "session_id": session_id}
+        message, session_id, doc_name, error = await parse_chat_request(request, message, session_id, doc_name)
+        if error:
+            return {"reply": error}
 
-        # Check if the query is document-related
-        if not is_document_related_query(message):
-            # Save assistant message for non-document queries too
-            assistant_message = Message(
-                role="assistant",
-                content="I can only answer questions based on your uploaded documents. Please ask about the content in your PDFs.",
-                timestamp=datetime.now()
-            )
-            add_message_to_session(session_id, assistant_message)
-            
-            return {
-                "reply": "I can only answer questions based on your uploaded documents. Please ask about the content in your PDFs.",
-                "session_id": session_id
-            }
-
-        # Embed the user question
-        query_embedding = get_embedding(message)
-
-        # Search vector index for most relevant chunks
-        index, docs = load_faiss_index(doc_filter=doc_name)
-        if index is None or not docs:
-            error_message = f"❌ No data available for document: {doc_name}" if doc_name else "❌ No documents have been trained yet."
-            
-            # Save assistant message for error cases
-            assistant_message = Message(
-                role="assistant",
-                content=error_message,
-                timestamp=datetime.now()
-            )
-            add_message_to_session(session_id, assistant_message)
-            
-            return {
-                "reply": error_message,
-                "session_id": session_id
-            }
-
-        # Search for more relevant chunks with improved scoring
-        D, I = index.search(np.array([query_embedding]), k=12)  # Get more candidates for comprehensive results
-
-        # Improved relevance filtering with dynamic threshold
-        relevant_chunks = []
-        chunk_scores = []
-
-        for i, distance in zip(I[0], D[0]):
-            if i < len(docs):
-                # Calculate relevance score (lower distance = higher relevance)
-                relevance_score = 1.0 / (1.0 + distance)
-                chunk_scores.append((docs[i], relevance_score, distance))
-
-        # Sort by relevance score and filter by adaptive threshold
-        chunk_scores.sort(key=lambda x: x[1], reverse=True)
-
-        # Special handling for comprehensive queries (like "what are linux commands")
-        is_comprehensive_query = any(word in message.lower() for word in ['what are', 'list all', 'show all', 'all the', 'commands'])
-
-        # Make the search more inclusive
-        if is_comprehensive_query:
-            threshold = 0.2  # Lower threshold for more inclusive results
-            max_chunks = 12   # More chunks for comprehensive answers
-        else:
-            if chunk_scores:
-                best_score = chunk_scores[0][1]
-                threshold = best_score * 0.4  # More lenient than before
-            else:
-                threshold = 0.3
-            max_chunks = 8
-
-        for chunk, score, distance in chunk_scores:
-            if score >= threshold and distance < 3.0:  # More lenient distance threshold
-                relevant_chunks.append(chunk)
-            if len(relevant_chunks) >= max_chunks:
-                break
-
-        # If no chunks meet threshold, take the best ones
-        if not relevant_chunks:
-            relevant_chunks = [chunk for chunk, _, _ in chunk_scores[:max_chunks]]
-
-        # Prepare enhanced context with better formatting and query-specific ordering
-        selected_chunks = relevant_chunks[:max_chunks]
-        context = enhance_context_for_query(selected_chunks, message)
-
-        # Prepare request payload for LLM
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost:5173",
-            "X-Title": "OLIR Chatbot"
-        }
-
-        # Update system instruction to encourage use of all context
-        system_instruction = (
-            "You are a helpful document analysis assistant. Your task is to provide accurate and COMPREHENSIVE answers based on the provided document context.\n\n"
-            "INSTRUCTIONS:\n"
-            "1. Use ALL relevant information from the provided context.\n"
-            "2. If the answer is present in the context, provide it clearly.\n"
-            "3. If the answer is not directly in the context, but you can infer it from the context, do so and explain your reasoning.\n"
-            "4. If the answer truly cannot be found, say: 'The provided document does not contain specific information about [topic]'.\n"
-            "5. Include examples, details, and references from the document when available.\n"
-            "6. If multiple sections are relevant, combine them in your answer.\n"
-            "7. Be precise and specific.\n\n"
-            "Format your response as:\n"
-            "- Direct comprehensive answer using ALL relevant information from context\n"
-            "- Include specific examples and syntax when available\n"
-            "- Reference page/section numbers if mentioned in context"
-        )
+        session_id = start_turn(message, session_id, doc_name)
 
-        payload = {
-            "model": "mistralai/mistral-small-3.2-24b-instruct:free",  # Better model for accuracy
-            "messages": [
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": f"DOCUMENT CONTEXT:\n{context}\n\nUSER QUESTION: {message}\n\nPlease provide an accurate answer based solely on the document context above."}
-            ],
-            "temperature": 0.1,  # Lower temperature for more consistent, accurate responses
-            "max_tokens": 1000
-        }
-
-        response = requests.post(OPENROUTER_URL, headers=headers, json=payload)
-
-        if response.status_code != 200:
-            error_message = f"⚠️ LLM provider error {response.status_code}"
-            
-            # Save assistant message for error cases
-            assistant_message = Message(
-                role="assistant",
-                content=error_message,
-                timestamp=datetime.now()
-            )
-            add_message_to_session(session_id, assistant_message)
-            
-            return {
-                "reply": error_message,
-                "error": response.text,
-                "session_id": session_id
-            }
-
-        data = response.json()
-        reply = data["choices"][0]["message"]["content"]
-
-        # Save assistant message to session
-        assistant_message = Message(
-            role="assistant",
-            content=reply.strip(),
-            timestamp=datetime.now()
-        )
-        add_message_to_session(session_id, assistant_message)
+        reply = canned_reply(message)
+        if reply:
+            save_reply(session_id, reply)
+            return {"reply": reply, "session_id": session_id}
 
-        return {
-            "reply": reply.strip(),
-            "context_used": selected_chunks,
-            "session_id": session_id
-        }
+        # The same question about the same document already in flight: wait for that answer instead of repeating it
+        result = await in_flight.do((normalize_question(message), doc_name), lambda: answer_question(message, doc_name))
+
+        save_reply(session_id, result["reply"])
+        return {**result, "session_id": session_id}
         
     except Exception as e:
         print(f"Chat endpoint error: {e}")
         error_message = f"❌ Server error: {str(e)}"
         
         # Try to save error message if session_id exists
-        if 'session_id' in locals():
+        if session_id:
             try:
-                assistant_message = Message(
-                    role="assistant",
-                    content=error_message,
-                    timestamp=datetime.now()
-                )
-                add_message_to_session(session_id, assistant_message)
+                save_reply(session_id, error_message)
             except:
                 pass  # Don't fail if we can't save the error message
         
         return {"reply": error_message}
 
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: Request, message: str = Query(None), session_id: str = Query(None), doc_name: str = Query(None)):
+    """
+    Streaming variant of /chat over Server-Sent Events. Takes the same request
+    formats and emits, in order:
+
+        event: context  {"session_id", "sources": [...], "context_used": [...]}
+        event: token    {"text"}   (one per provider delta)
+        event: done     {"reply", "session_id"}
+
+    or `event: error {"reply", "error"?, "session_id"}` if the turn fails.
+    Greetings, questions with nothing indexed and answer-cache hits get
+    their whole reply as a single token. The assembled reply is saved to the session when the stream
+    ends, including a partial one if the client disconnects mid-answer.
+    """
+    message, session_id, doc_name, error = await parse_chat_request(request, message, session_id, doc_name)
+
+    async def events():
+        if error:
+            yield sse("error", {"reply": error})
+            return
+        turn_id = start_turn(message, session_id, doc_name)
+
+        reply = canned_reply(message)
+        if reply:
+            save_reply(turn_id, reply)
+            yield sse("context", {"session_id": turn_id, "sources": [], "context_used": []})
+            yield sse("token", {"text": reply})
+            yield sse("done", {"reply": reply, "session_id": turn_id})
+            return
+
+        parts = []
+        failure = None
+        try:
+            query_embedding = await embed_query(message)
+            corpus_version = await current_corpus_version()
+            cached = answer_cache.get(query_embedding, doc_name, corpus_version)
+            if cached:
+                parts.append(cached.reply)
+                yield sse("context", {"session_id": turn_id, "sources": cached.sources, "context_used": cached.context_used, "cached": True})
+                yield sse("token", {"text": cached.reply})
+                yield sse("done", {"reply": cached.reply, "session_id": turn_id, "cached": True})
+                return
+
+            hits = await run_in_threadpool(retrieve_context, message, doc_name, query_embedding)
+            if not hits:
+                failure = no_results_reply(doc_name)
+                yield sse("context", {"session_id": turn_id, "sources": [], "context_used": []})
+                yield sse("token", {"text": failure})
+                yield sse("done", {"reply": failure, "session_id": turn_id})
+                return
+
+            selected_chunks = [hit.text for hit in hits]
+            yield sse("context", {
+                "session_id": turn_id,
+                "sources": [hit_source(hit) for hit in hits],
+                "context_used": selected_chunks
+            })
+
+            payload = build_payload(message, selected_chunks)
+            async for text in stream_completion(payload, api_key=OPENROUTER_API_KEY):
+                parts.append(text)
+                yield sse("token", {"text": text})
+
+            reply = "".join(parts).strip()
+            if reply:
+                answer_cache.put(query_embedding, doc_name, corpus_version,
+                                 CachedAnswer(message, reply, selected_chunks, [hit_source(hit) for hit in hits]))
+            yield sse("done", {"reply": reply, "session_id": turn_id, "cached": False})
+        except LLMError as e:
+            failure = f"⚠️ LLM provider error {e.status_code}"
+            yield sse("error", {"reply": failure, "error": e.body, "session_id": turn_id})
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            failure = f"❌ Server error: {str(e)}"
+            yield sse("error", {"reply": failure, "session_id": turn_id})
+        finally:
+            # Runs on normal completion, on errors and when the client goes away (generator closed)
+            reply = "".join(parts).strip() or failure
+            if reply:
+                try:
+                    save_reply(turn_id, reply)
+                except Exception as e:
+                    print(f"Could not save streamed reply: {e}")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies (nginx) from buffering the stream into one late response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/chat/history")
 def get_all_chat_history():
     return load_all_sessions()
@@ -0,0 +1,43 @@
+# routers/status.py
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+router = APIRouter()
+
+@router.get("/status/embedding-cache")
+def get_embedding_cache_stats():
+    """Hit/miss counters and size of the embedding cache"""
+    from utils.embedder import cache
+    return cache.get_stats()
+
+@router.get("/status/answer-cache")
+def get_answer_cache_stats():
+    """Hit/miss counters and size of the semantic answer cache"""
+    from utils.answer_cache import answer_cache
+    return answer_cache.get_stats()
+
+@router.get("/status/chat-coalescing")
+def get_chat_coalescing_stats():
+    """How many /chat requests started an answer and how many joined one already in flight"""
+    from routers.chat import in_flight
+    return in_flight.get_stats()
+
+@router.get("/status/llm")
+def get_llm_stats():
+    """Retry/hedge counters, latency percentiles and circuit-breaker state of the LLM client"""
+    from utils.llm_client import get_stats
+    return get_stats()
+
+@router.get("/status/ingest")
+def get_ingest_stats():
+    """Ingest workers, jobs waiting for one, and ledger counts by status"""
+    from routers.upload import ingest_jobs
+    return ingest_jobs.get_stats()
+
+@router.get("/ready")
+def get_readiness():
+    """200 once the embedding model and vector index are loaded, 503 (with per-component status) until then"""
+    from utils.warmup import readiness
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -2,15 +2,37 @@
 
 from fastapi import APIRouter
 import os
+from datetime import datetime
 from pathlib import Path
+from routers.upload import ingest_jobs
 
 router = APIRouter()
 
+def training_session(job: dict) -> dict:
+    """A training session as the history page shows it, from an ingest job in the ledger"""
+    duration = None
+    if job["started_at"] and job["finished_at"]:
+        elapsed = datetime.fromisoformat(job["finished_at"]) - datetime.fromisoformat(job["started_at"])
+        duration = f"{round(elapsed.total_seconds(), 2)}s"
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "timestamp": job["created_at"],
+        "duration": duration,
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "documentsCount": 1,
+        "documents": [{"name": job["filename"]}]
+    }
+
 @router.get("/training-history")
 def get_training_history():
+    sessions = [training_session(job) for job in ingest_jobs.list()]
+
     training_folder = Path("data/user_docs/")
     if not training_folder.exists():
-        return {"files": []}
+        return {"files": [], "sessions": sessions}
     
     files = [
         {
@@ -19,4 +41,4 @@ def get_training_history():
         }
         for file in training_folder.glob("*.pdf")
     ]
-    return {"files": files}
+    return {"files": files, "sessions": sessions}
@@ -1,16 +1,20 @@
 from fastapi import APIRouter, UploadFile, File, Body
+import asyncio
 import os
 import datetime
 import json
+import re
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
-from utils.processor import extract_text_from_pdf, smart_chunk_text, extract_key_information
-from utils.context_enhancer import preprocess_pdf_text
-from utils.embedder import get_embedding
-from utils.vector_store import create_or_update_index
-from utils.summarizer import generate_summary_from_text
-from utils.training_memory import training_sessions
+from utils.processor import extract_text_from_pdf, smart_chunk_text, extract_key_information, assign_chunk_pages
+from utils.context_enhancer import preprocess_pdf_text, split_header
+from utils.embed_pool import INGEST, embed
+from utils.embedder import EMBED_BATCH_SIZE
+from utils.vector_store import add_chunks, get_vector_store
+from utils.document_analyzer import EMPTY_ANALYSIS, generate_document_analysis
+from utils.job_queue import JobProgress, JobQueue
 from datetime import datetime
-import uuid
 import time
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
@@ -22,79 +26,173 @@ router = APIRouter()
 UPLOAD_DIR = "data/user_docs/"
 os.makedirs(UPLOAD_DIR, exist_ok=True)  # ✅ Important fix here
 
+def build_document_chunks(filename: str, text: str):
+    """Split a preprocessed document into the texts we index, plus metadata for each one"""
+    # Extract key information for better context
+    key_info = extract_key_information(text)
+
+    # Create intelligent chunks with better parameters for accuracy
+    chunks = smart_chunk_text(text, chunk_size=1200, overlap=200)
+
+    pages = assign_chunk_pages(chunks)
+
+    texts = []
+    metadata = []
+
+    # Add document metadata to each chunk for better retrieval
+    for i, chunk in enumerate(chunks):
+        texts.append(f"Document: {filename}\nChunk {i+1}/{len(chunks)}\n\n{chunk}")
+        metadata.append({"doc_name": filename, "chunk": i + 1, "page": pages[i], "kind": "chunk"})
+
+    # Also store key information separately for better retrieval
+    for heading in key_info['headings'][:5]:  # Limit to top 5 headings
+        texts.append(f"Document: {filename}\nHeading: {heading}")
+        metadata.append({"doc_name": filename, "chunk": None, "page": None, "kind": "heading"})
+
+    for definition in key_info['definitions'][:10]:  # Limit to top 10 definitions
+        texts.append(f"Document: {filename}\nDefinition: {definition}")
+        metadata.append({"doc_name": filename, "chunk": None, "page": None, "kind": "definition"})
+
+    return texts, metadata
+
+def embedding_text(text: str) -> str:
+    """
+    The part of an indexed text that is embedded (and keys the embedding cache): the body without the
+    "Document: name / Chunk i/N" header, so a revision under another name or with another chunk count reuses unchanged chunks
+    """
+    return split_header(text)[2]
+
+async def embed_document_chunks(texts, progress: JobProgress) -> np.ndarray:
+    """Embed a document's texts on the embedding pool batch by batch, reporting each finished batch"""
+    texts = [embedding_text(text) for text in texts]
+    batches = [texts[start:start + EMBED_BATCH_SIZE] for start in range(0, len(texts), EMBED_BATCH_SIZE)]
+    done = 0
+
+    async def embed_batch(batch):
+        nonlocal done
+        # Ingest priority: chat queries arriving meanwhile are embedded between this document's batches
+        vectors = await embed(batch, priority=INGEST)
+        done += 1
+        progress.update(done / len(batches))
+        return vectors
+
+    return np.vstack(await asyncio.gather(*(embed_batch(batch) for batch in batches)))
+
+def summary_path(file_path: str) -> str:
+    """Where a document's analysis is stored, next to the document"""
+    return os.path.splitext(file_path)[0] + ".json"
+
+def load_document_text(file_path: str, on_page=None) -> str:
+    """Preprocessed text of an uploaded document (PDF or transcript .txt)"""
+    if file_path.lower().endswith(".pdf"):
+        raw_text = extract_text_from_pdf(file_path, on_page)
+    else:
+        with open(file_path, "r", encoding="utf-8") as f:
+            raw_text = f.read()
+    return preprocess_pdf_text(raw_text)
+
+async def analyze_document(filename: str, text: str) -> dict:
+    """Post-ingest stage: analyze the whole document and store the result where /documents reads it"""
+    start_time = time.time()
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    try:
+        analysis = await generate_document_analysis(text)
+    except Exception:
+        print("🔥 ANALYSIS ERROR:", traceback.format_exc())
+        return None
+    if not isinstance(analysis, dict) or analysis == EMPTY_ANALYSIS:
+        print(f"⚠️ Analysis of {filename} failed; it will be retried on the next analyze request.")
+        return None
+    # The document may have been deleted while it was being analyzed
+    if not os.path.exists(file_path):
+        return None
+
+    analysis["analyzed_at"] = datetime.now().isoformat()
+    tmp_path = summary_path(file_path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(analysis, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, summary_path(file_path))
+    print(f"✅ Analyzed {filename} in {time.time() - start_time:.2f}s")
+    return analysis
+
 def fetch_youtube_transcript(url: str) -> str:
     # MOCK: Replace with real implementation or use youtube_transcript_api
     # For now, just return a dummy transcript
     return f"Transcript for {url}\nThis is a mock transcript. Replace with real fetch logic."
 
-@router.post("/upload-youtube")
-async def upload_youtube_and_train(youtube_url: str = Body(..., embed=True)):
-    start_time = time.time()
+# Stages of an ingest job, with each one's share of the job's progress
+INGEST_STAGES = [("extract", 0.15), ("chunk", 0.05), ("embed", 0.6), ("index", 0.1), ("analyze", 0.1)]
 
-    # Fetch transcript
-    transcript_text = fetch_youtube_transcript(youtube_url)
-    if not transcript_text or len(transcript_text.strip()) < 10:
-        return {"error": "Failed to fetch transcript or transcript is empty."}
-
-    # Save transcript as a .txt file
-    import re
-    safe_title = re.sub(r'[^a-zA-Z0-9_-]', '_', youtube_url[-20:])
-    filename = f"youtube_{safe_title}.txt"
+async def run_ingest_job(job: dict, progress: JobProgress) -> dict:
+    """Train on one uploaded document: extract its text, chunk, embed and index it, then analyze it"""
+    filename = job["filename"]
     file_path = os.path.join(UPLOAD_DIR, filename)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(transcript_text)
 
-    # Preprocess text to improve quality
-    text = preprocess_pdf_text(transcript_text)
-
-    # Extract key information for better context
-    key_info = extract_key_information(text)
-    
-    # Create intelligent chunks with better parameters for accuracy
-    chunks = smart_chunk_text(text, chunk_size=1200, overlap=200)
-    
-    # Add document metadata to each chunk for better retrieval
-    enhanced_chunks = []
-    for i, chunk in enumerate(chunks):
-        enhanced_chunk = f"Document: {filename}\nChunk {i+1}/{len(chunks)}\n\n{chunk}"
-        enhanced_chunks.append(enhanced_chunk)
-    
-    # Store embeddings for all chunks
-    for chunk in enhanced_chunks:
-        emb = get_embedding(chunk)
-        create_or_update_index(emb, chunk, [])
-    
-    # Also store key information separately for better retrieval
-    for heading in key_info['headings'][:5]:
-        enhanced_heading = f"Document: {filename}\nHeading: {heading}"
-        emb = get_embedding(enhanced_heading)
-        create_or_update_index(emb, enhanced_heading, [])
-    for definition in key_info['definitions'][:10]:
-        enhanced_definition = f"Document: {filename}\nDefinition: {definition}"
-        emb = get_embedding(enhanced_definition)
-        create_or_update_index(emb, enhanced_definition, [])
-
-    duration = round(time.time() - start_time, 2)
-
-    training_sessions.append({
-        "id": str(uuid.uuid4()),
-        "status": "completed",
-        "timestamp": datetime.now().isoformat(),
-        "duration": f"{duration}s",
-        "documentsCount": 1,
-        "documents": [{"name": filename}]
+    with progress.stage("extract"):
+        if job["kind"] == "youtube":
+            transcript_text = await run_in_threadpool(fetch_youtube_transcript, job["source"])
+            if not transcript_text or len(transcript_text.strip()) < 10:
+                raise ValueError("Failed to fetch transcript or transcript is empty.")
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(transcript_text)
+        # Off the event loop, large PDFs take a while
+        text = await run_in_threadpool(load_document_text, file_path,
+                                       lambda done, total: progress.update(done / total))
+
+    with progress.stage("chunk"):
+        texts, metadata = await run_in_threadpool(build_document_chunks, filename, text)
+
+    with progress.stage("embed"):
+        embeddings = await embed_document_chunks(texts, progress) if texts else None
+
+    with progress.stage("index"):
+        # The document may have been deleted while it was being extracted and embedded
+        if not os.path.exists(file_path):
+            print(f"⚠️ {filename} was deleted before it was indexed; skipping.")
+            return {"chunks": 0, "analyzed": False, "skipped": "deleted"}
+        # Replace what an earlier upload under the same filename, or an interrupted attempt, indexed
+        snapshot = await run_in_threadpool(get_vector_store().snapshot)
+        if filename in snapshot.shards:
+            await run_in_threadpool(delete_from_index, filename)
+        if texts:
+            # The whole document in a single write
+            await run_in_threadpool(add_chunks, embeddings, texts, metadata)
+        if not os.path.exists(file_path):
+            # Deleted while it was being indexed: drop the chunks the delete could not see yet
+            await run_in_threadpool(delete_from_index, filename)
+            return {"chunks": 0, "analyzed": False, "skipped": "deleted"}
+
+    with progress.stage("analyze"):
+        # The document is already searchable; a failed analysis does not fail the job
+        try:
+            analysis = await analyze_document(filename, text)
+        except Exception:
+            print("🔥 ANALYSIS ERROR:", traceback.format_exc())
+            analysis = None
+
+    return {"chunks": len(texts), "analyzed": analysis is not None}
+
+# Uploads return at once; a small pool of workers trains on them from a ledger that survives restarts
+ingest_jobs = JobQueue(run_ingest_job, INGEST_STAGES)
+
+def job_accepted(message: str, job: dict) -> JSONResponse:
+    return JSONResponse(status_code=202, content={
+        "message": message,
+        "filename": job["filename"],
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}"
     })
 
-    return {
-        "message": "YouTube transcript uploaded and trained successfully",
-        "filename": filename,
-        "duration": duration
-    }
+@router.post("/upload-youtube")
+async def upload_youtube_and_train(youtube_url: str = Body(..., embed=True)):
+    # The transcript is fetched by the ingest job
+    safe_title = re.sub(r'[^a-zA-Z0-9_-]', '_', youtube_url[-20:])
+    job = ingest_jobs.submit("youtube", f"youtube_{safe_title}.txt", source=youtube_url)
+    return job_accepted("YouTube transcript queued for training", job)
 
 @router.post("/upload")
 async def upload_and_train(file: UploadFile = File(...)):
-    start_time = time.time()
-
     # Fix: Ensure file.filename is not None
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file name provided.")
@@ -102,59 +200,21 @@ async def upload_and_train(file: UploadFile = File(...)):
     with open(file_path, "wb") as f:
         f.write(await file.read())
 
-    # Extract text from PDF
-    raw_text = extract_text_from_pdf(file_path)
+    job = ingest_jobs.submit("pdf", file.filename, source=file_path)
+    return job_accepted("File uploaded and queued for training", job)
 
-    # Preprocess text to improve quality
-    text = preprocess_pdf_text(raw_text)
+@router.get("/jobs")
+async def list_jobs(limit: int = 100, status: str = None):
+    """Ingest jobs, most recent first"""
+    return {"jobs": ingest_jobs.list(limit=limit, status=status)}
 
-    # Extract key information for better context
-    key_info = extract_key_information(text)
-    
-    # Create intelligent chunks with better parameters for accuracy
-    chunks = smart_chunk_text(text, chunk_size=1200, overlap=200)
-    
-    # Add document metadata to each chunk for better retrieval
-    enhanced_chunks = []
-    for i, chunk in enumerate(chunks):
-        # Add document context to each chunk
-        enhanced_chunk = f"Document: {file.filename}\nChunk {i+1}/{len(chunks)}\n\n{chunk}"
-        enhanced_chunks.append(enhanced_chunk)
-    
-    # Store embeddings for all chunks
-    for chunk in enhanced_chunks:
-        emb = get_embedding(chunk)
-        create_or_update_index(emb, chunk, [])
-    
-    # Also store key information separately for better retrieval
-    for heading in key_info['headings'][:5]:  # Limit to top 5 headings
-        enhanced_heading = f"Document: {file.filename}\nHeading: {heading}"
-        emb = get_embedding(enhanced_heading)
-        create_or_update_index(emb, enhanced_heading, [])
-    
-    for definition in key_info['definitions'][:10]:  # Limit to top 10 definitions
-        enhanced_definition = f"Document: {file.filename}\nDefinition: {definition}"
-        emb = get_embedding(enhanced_definition)
-        create_or_update_index(emb, enhanced_definition, [])
-
-    duration = round(time.time() - start_time, 2)
-
-    training_sessions.append({
-        "id": str(uuid.uuid4()),
-        "status": "completed",
-        "timestamp": datetime.now().isoformat(),
-        "duration": f"{duration}s",
-        "documentsCount": 1,
-        "documents": [{"name": file.filename}]
-    })
-
-    # ✅ This return was missing
-    return {
-        "message": "File uploaded and trained successfully",
-        "filename": file.filename,
-        "duration": duration
-    }
- 
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of one ingest job: its stage, overall progress and the seconds spent in each finished stage"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.get("/documents")
 async def list_documents():
@@ -164,8 +224,8 @@ async def list_documents():
     for f in files:
         file_path = os.path.join(UPLOAD_DIR, f)
 
-        # Skip if it's not a file
-        if not os.path.isfile(file_path):
+        # Skip if it's not a file, or it is a document's stored analysis
+        if not os.path.isfile(file_path) or f.endswith((".json", ".tmp")):
             continue
 
         # Calculate file size in MB
@@ -178,10 +238,9 @@ async def list_documents():
 
         # Attempt to load summary from JSON
         summary = "No summary available."
-        summary_path = os.path.splitext(file_path)[0] + ".json"
-        if os.path.exists(summary_path):
+        if os.path.exists(summary_path(file_path)):
             try:
-                with open(summary_path, "r") as sf:
+                with open(summary_path(file_path), "r", encoding="utf-8") as sf:
                     summary_data = json.load(sf)
                     summary = summary_data.get("summary", summary)
             except Exception as e:
@@ -205,18 +264,17 @@ async def list_documents():
 @router.delete("/documents/{filename}")
 async def delete_document(filename: str):
     file_path = os.path.join(UPLOAD_DIR, filename)
-    summary_path = os.path.splitext(file_path)[0] + ".json"
 
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
 
     try:
         # Optional: remove from FAISS index
-        delete_from_index(filename)  # <-- could be failing
+        await run_in_threadpool(delete_from_index, filename)
 
         os.remove(file_path)
-        if os.path.exists(summary_path):
-            os.remove(summary_path)
+        if os.path.exists(summary_path(file_path)):
+            os.remove(summary_path(file_path))
 
         return {"detail": "Document deleted successfully"}
     except Exception as e:
@@ -224,6 +282,18 @@ async def delete_document(filename: str):
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
     
     
+@router.post("/documents/{filename}/analyze")
+async def reanalyze_document(filename: str):
+    """Recompute a document's analysis; sections unchanged since the last run come from the partial-summary cache"""
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    text = await run_in_threadpool(load_document_text, file_path)
+    analysis = await analyze_document(filename, text)
+    if analysis is None:
+        raise HTTPException(status_code=502, detail="Document analysis failed")
+    return analysis
+
 @router.get("/download/{filename}")
 async def download_document(filename: str):
     file_path = os.path.join(UPLOAD_DIR, filename)
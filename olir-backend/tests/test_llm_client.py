@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+from utils import llm_client
+from utils.llm_client import CircuitBreaker, LLMError
+
+COOLDOWN = 0.05
+
+
+def open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failures=2, cooldown=COOLDOWN)
+    breaker.record(False)
+    breaker.record(False)
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=2, cooldown=COOLDOWN)
+    breaker.record(False)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failures=2, cooldown=COOLDOWN)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = open_breaker()
+    time.sleep(COOLDOWN)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes_the_circuit():
+    breaker = open_breaker()
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = open_breaker()
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_abandoned_trial_reopens_the_circuit():
+    breaker = open_breaker()
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    breaker.abandon()
+    assert breaker.state == "open"
+    # Once the cooldown has passed again, a new trial is allowed
+    time.sleep(COOLDOWN)
+    assert breaker.allow()
+
+
+def test_abandon_outside_a_trial_is_a_no_op():
+    breaker = CircuitBreaker(failures=2, cooldown=COOLDOWN)
+    breaker.abandon()
+    assert breaker.state == "closed"
+
+
+def test_cancelled_trial_call_does_not_leave_the_circuit_half_open(monkeypatch):
+    breaker = open_breaker()
+    monkeypatch.setattr(llm_client, "_breaker", breaker)
+
+    async def hang(payload, api_key):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(llm_client, "_hedged", hang)
+
+    async def cancel_trial():
+        await asyncio.sleep(COOLDOWN)
+        task = asyncio.ensure_future(llm_client.chat_completion({}, deadline=5))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half-open"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert breaker.state == "open"
+    with pytest.raises(LLMError) as error:
+        asyncio.run(llm_client.chat_completion({}))
+    assert error.value.status_code == 503
@@ -0,0 +1,28 @@
+from utils.context_enhancer import preprocess_pdf_text
+from utils.processor import assign_chunk_pages, smart_chunk_text
+
+
+def extracted_pages(count: int) -> str:
+    """Text laid out as extract_text_from_pdf writes it, one paragraph per page"""
+    return "".join(
+        f"\n=== Page {n} ===\nSection {n} describes step {n}0 of the setup. " + "Filler sentence here. " * 40 + "\n"
+        for n in range(1, count + 1)
+    )
+
+
+def test_page_markers_survive_preprocessing():
+    text = preprocess_pdf_text(extracted_pages(150))
+    assert "=== Page 150 ===" in text
+    assert "=== Page 10 ===" in text
+
+
+def test_chunks_past_page_nine_get_their_own_page():
+    chunks = smart_chunk_text(preprocess_pdf_text(extracted_pages(15)), chunk_size=1200, overlap=200)
+    pages = assign_chunk_pages(chunks)
+    assert pages == sorted(pages)
+    assert max(pages) >= 14
+    # A chunk is labeled with the page it starts on
+    starts = [int(chunk.split("=== Page ", 1)[1].split(" ", 1)[0]) for chunk in chunks
+              if chunk.lstrip().startswith("=== Page ")]
+    assert starts
+    assert all(start in pages for start in starts)
@@ -0,0 +1,119 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+import pytest
+
+from utils import vector_store
+from utils.chunk_store import ChunkStore
+from utils.vector_store import VectorStore
+
+DIM = 16
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Run every test against its own empty data/ directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def document(name: str, count: int, seed: int = 0):
+    """Random embeddings, chunk texts and metadata for one document"""
+    vectors = np.random.default_rng(seed).random((count, DIM), dtype="float32")
+    chunks = [f"Document: {name}\nChunk {i + 1}/{count}\ntext {i}" for i in range(count)]
+    metadata = [{"doc_name": name, "chunk": i + 1, "page": None, "kind": "chunk"} for i in range(count)]
+    return vectors, chunks, metadata
+
+
+def segment_files():
+    return set(os.listdir(vector_store.SEGMENTS_DIR)) if os.path.isdir(vector_store.SEGMENTS_DIR) else set()
+
+
+def test_filtered_search_only_returns_that_documents_chunks():
+    store = VectorStore()
+    a_vectors, a_chunks, a_metadata = document("a.pdf", 6, seed=1)
+    b_vectors, b_chunks, b_metadata = document("b.pdf", 6, seed=2)
+    store.add_chunks(a_vectors, a_chunks, a_metadata)
+    store.add_chunks(b_vectors, b_chunks, b_metadata)
+
+    # The query is one of a.pdf's chunks, but filtered to b.pdf
+    hits = store.search(a_vectors[0], k=4, doc_filter="b.pdf")
+    assert len(hits) == 4
+    assert all(hit.metadata["doc_name"] == "b.pdf" for hit in hits)
+    assert {hit.text for hit in hits} <= set(b_chunks)
+    assert [hit.distance for hit in hits] == sorted(hit.distance for hit in hits)
+
+    assert store.search(a_vectors[0], k=1, doc_filter="a.pdf")[0].text == a_chunks[0]
+    assert store.search(a_vectors[0], k=4, doc_filter="missing.pdf") == []
+
+
+def test_crash_before_commit_segment_is_replayed_from_the_wal(monkeypatch):
+    store = VectorStore()
+    store.add_chunks(*document("a.pdf", 5, seed=1))
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("simulated crash")
+
+    vectors, chunks, metadata = document("b.pdf", 4, seed=2)
+    with monkeypatch.context() as m:
+        m.setattr(ChunkStore, "commit_segment", crash)
+        with pytest.raises(RuntimeError):
+            store.add_chunks(vectors, chunks, metadata)
+    # The segment file was written but never made it into the manifest
+    assert len(segment_files()) == 2
+
+    reloaded = VectorStore()
+    snapshot = reloaded.snapshot()
+    assert set(snapshot.shards) == {"a.pdf", "b.pdf"}
+    assert snapshot.ntotal == 9
+    assert segment_files() == {segment.file for segment in snapshot.segments}
+    hit = reloaded.search(vectors[0], k=1)[0]
+    assert hit.text == chunks[0]
+    assert hit.metadata["doc_name"] == "b.pdf"
+
+
+def test_delete_during_merge_drops_the_merged_segment(monkeypatch):
+    store = VectorStore()
+    store.merge_in_background = lambda: None
+    for n in range(vector_store.MAX_SEGMENTS + 1):
+        store.add_chunks(*document("a.pdf", 3, seed=n))
+    store.add_chunks(*document("b.pdf", 3, seed=99))
+
+    build_index = vector_store.build_index
+
+    def build_then_delete(*args, **kwargs):
+        index = build_index(*args, **kwargs)
+        store.delete_document("a.pdf")
+        return index
+
+    monkeypatch.setattr(vector_store, "build_index", build_then_delete)
+    assert store.merge() is False
+
+    assert set(store.snapshot().shards) == {"b.pdf"}
+    assert segment_files() == {segment.file for segment in store.snapshot().segments}
+    assert set(VectorStore().snapshot().shards) == {"b.pdf"}
+
+
+def test_legacy_index_is_migrated_and_renamed():
+    os.makedirs("data/faiss_index")
+    a_vectors, a_chunks, _ = document("a.pdf", 3, seed=1)
+    b_vectors, b_chunks, _ = document("b.pdf", 2, seed=2)
+    legacy = faiss.IndexFlatL2(DIM)
+    legacy.add(np.vstack([a_vectors, b_vectors]))
+    faiss.write_index(legacy, vector_store.INDEX_PATH)
+    with open(vector_store.DOCS_PATH, "wb") as f:
+        pickle.dump(a_chunks + b_chunks, f)
+
+    store = VectorStore()
+    snapshot = store.snapshot()
+    assert {name: sum(s.size for s in segments) for name, segments in snapshot.shards.items()} == {"a.pdf": 3, "b.pdf": 2}
+    assert not os.path.exists(vector_store.INDEX_PATH)
+    assert not os.path.exists(vector_store.DOCS_PATH)
+    assert os.path.exists(vector_store.INDEX_PATH + ".migrated")
+    assert os.path.exists(vector_store.DOCS_PATH + ".migrated")
+    assert store.search(b_vectors[1], k=1)[0].text == b_chunks[1]
+
+    # A second start reads the segments and leaves the migrated files alone
+    assert VectorStore().snapshot().ntotal == 5
@@ -0,0 +1,127 @@
+import numpy as np
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") != "0"
+# Cosine similarity a new question's embedding needs to an answered one to reuse its answer
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_ENTRIES", "1000"))
+
+
+class CachedAnswer(NamedTuple):
+    question: str
+    reply: str
+    context_used: List[str]
+    sources: List[dict]
+
+
+class _Entry(NamedTuple):
+    doc_filter: Optional[str]
+    corpus_version: int
+    vector: np.ndarray
+    answer: CachedAnswer
+    created: float
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """
+    Answers to earlier questions, looked up by query-embedding similarity.
+
+    An entry only matches questions with the same document filter asked
+    against the same corpus version (see VectorStore.corpus_version), so an
+    upload or delete invalidates every cached answer; stale entries are
+    dropped as soon as a newer version is seen. Entries also expire after
+    TTL_SECONDS, and the least recently used go first past MAX_ENTRIES.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl: float = TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._corpus_version = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _observe(self, corpus_version: int):
+        # Caller holds the lock
+        if corpus_version > self._corpus_version:
+            if self._entries:
+                self.stats["invalidations"] += len(self._entries)
+                self._entries.clear()
+            self._corpus_version = corpus_version
+
+    def get(self, query_embedding, doc_filter: Optional[str], corpus_version: int) -> Optional[CachedAnswer]:
+        """The cached answer to the most similar earlier question, if it is similar enough."""
+        if not self.enabled:
+            return None
+        query = _unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._observe(corpus_version)
+            expired = [key for key, entry in self._entries.items() if now - entry.created > self.ttl]
+            for key in expired:
+                del self._entries[key]
+            self.stats["evictions"] += len(expired)
+
+            candidates = [(key, entry) for key, entry in self._entries.items()
+                          if entry.doc_filter == doc_filter and entry.corpus_version == corpus_version]
+            if candidates:
+                similarities = np.stack([entry.vector for _, entry in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry.answer
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, query_embedding, doc_filter: Optional[str], corpus_version: int, answer: CachedAnswer):
+        """
+        Remember an answer. Pass the corpus version read before retrieval, so an
+        answer built while an upload landed is never filed under the new version.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._observe(corpus_version)
+            if corpus_version < self._corpus_version:
+                return
+            self._entries[self._next_id] = _Entry(doc_filter, corpus_version, _unit(query_embedding), answer, time.monotonic())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "corpus_version": self._corpus_version,
+                "threshold": self.threshold,
+                "enabled": self.enabled
+            }
+
+
+answer_cache = AnswerCache()
@@ -1,37 +1,32 @@
-import requests
+import asyncio
 import os
+import re
+import time
+from utils.context_enhancer import count_tokens
+from utils.llm_client import complete
 
 # --- Configuration ---
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "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")
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 EXTRACTION_MODEL = "openai/gpt-4o-mini"
 SYNTHESIS_MODEL = "openai/gpt-4o-mini"
 
+# Contexts above this many tokens are extracted in parallel groups (map-reduce) instead of one call
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "3000"))
+# Context tokens per extraction call in map-reduce mode
+MAP_GROUP_TOKENS = int(os.getenv("MAP_GROUP_TOKENS", "1500"))
+# Extraction calls in flight at once for one question
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "6"))
+
+NO_INFORMATION = "NO_RELEVANT_INFORMATION_FOUND"
+NO_INFORMATION_ANSWER = "The provided document does not contain specific information about your query."
+
 # --- Helper Function to Call LLM ---
-def _call_llm(payload: dict) -> str:
-    """Generic function to make a call to the OpenRouter API."""
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:5173",
-        "X-Title": "OLIR Chatbot"
-    }
-    
-    response = requests.post(OPENROUTER_URL, headers=headers, json=payload)
-    
-    if response.status_code != 200:
-        print(f"LLM provider error {response.status_code}: {response.text}")
-        return f"Error: LLM provider returned status {response.status_code}"
-        
-    data = response.json()
-    if "choices" in data and data["choices"]:
-        return data["choices"][0]["message"]["content"]
-    else:
-        print(f"LLM response format error: {data}")
-        return "Error: Could not get a valid response from the language model."
+async def _call_llm(payload: dict) -> str:
+    """Generic function to make a call to the OpenRouter API through the shared client."""
+    return await complete(payload, api_key=OPENROUTER_API_KEY)
 
 # --- Step 1: Information Extraction ---
-def extract_facts_from_context(context: str, query: str) -> str:
+async def extract_facts_from_context(context: str, query: str) -> str:
     """
     First LLM call to extract all relevant facts from the context based on the user query.
     This step focuses on gathering raw information, not on formatting.
@@ -57,10 +52,10 @@ def extract_facts_from_context(context: str, query: str) -> str:
         "max_tokens": 1500
     }
     
-    return _call_llm(payload)
+    return await _call_llm(payload)
 
 # --- Step 2: Answer Synthesis ---
-def synthesize_answer_from_facts(facts: str, query: str) -> str:
+async def synthesize_answer_from_facts(facts: str, query: str) -> str:
     """
     Second LLM call to synthesize a final, well-structured answer from the extracted facts.
     This step focuses on presentation and clarity.
@@ -87,10 +82,10 @@ def synthesize_answer_from_facts(facts: str, query: str) -> str:
         "max_tokens": 1000
     }
     
-    return _call_llm(payload)
+    return await _call_llm(payload)
 
 # --- Step 3: General Answer Generation ---
-def answer_general_query_from_text(context: str, query: str) -> str:
+async def answer_general_query_from_text(context: str, query: str) -> str:
     """
     Answers a general question using the full text of a document.
     This is for broad questions that don't rely on specific vector-searched chunks.
@@ -114,4 +109,75 @@ def answer_general_query_from_text(context: str, query: str) -> str:
         "max_tokens": 1200
     }
     
-    return _call_llm(payload)
\ No newline at end of file
+    return await _call_llm(payload)
+
+# --- Map-Reduce Answer Generation ---
+def split_context(context: str, group_tokens: int = MAP_GROUP_TOKENS) -> list:
+    """
+    Split a context into groups of about `group_tokens` tokens, cutting between
+    "=== ... ===" sections (as written by enhance_context_for_query) or,
+    inside a section that is too long, between paragraphs.
+    """
+    pieces = []
+    for section in re.split(r'\n\n(?==== )', context):
+        if count_tokens(section) <= group_tokens:
+            pieces.append(section)
+        else:
+            pieces.extend(p for p in section.split("\n\n") if p.strip())
+
+    groups = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > group_tokens:
+            groups.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+def _has_facts(facts: str) -> bool:
+    facts = facts.strip()
+    return bool(facts) and NO_INFORMATION not in facts[:200] and not facts.startswith("Error:")
+
+async def extract_facts_map_reduce(context: str, query: str, group_tokens: int = MAP_GROUP_TOKENS,
+                                   concurrency: int = MAP_CONCURRENCY) -> list:
+    """
+    Map step: run extract_facts_from_context over groups of the context
+    concurrently, at most `concurrency` at a time. Returns one extraction per
+    group, in context order.
+    """
+    groups = split_context(context, group_tokens)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract(group):
+        async with semaphore:
+            return await extract_facts_from_context(group, query)
+
+    return await asyncio.gather(*(extract(group) for group in groups))
+
+async def generate_answer(context: str, query: str) -> str:
+    """
+    Answer a question from its context: extraction, then one synthesis call.
+
+    Large contexts use map-reduce, so the extraction wall-clock tracks the
+    slowest group instead of the whole context. Groups with nothing relevant
+    are dropped before synthesis, and synthesis is skipped if none are left.
+    """
+    start = time.perf_counter()
+    if count_tokens(context) > MAP_REDUCE_MIN_TOKENS:
+        results = await extract_facts_map_reduce(context, query)
+    else:
+        results = [await extract_facts_from_context(context, query)]
+
+    facts = [result.strip() for result in results if _has_facts(result)]
+    print(f"🗺️ Extracted facts from {len(facts)}/{len(results)} context groups.")
+    if not facts:
+        errors = [result for result in results if result.startswith("Error:")]
+        return errors[0] if errors else NO_INFORMATION_ANSWER
+
+    answer = await synthesize_answer_from_facts("\n\n".join(facts), query)
+    print(f"⏱️ Answer generated in {time.perf_counter() - start:.2f}s")
+    return answer
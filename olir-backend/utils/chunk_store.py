@@ -0,0 +1,180 @@
+import numpy as np
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CHUNK_DB_PATH = "data/faiss_index/chunks.db"
+
+# How much of the database file SQLite may map into memory; pages are only faulted in when read
+MMAP_BYTES = int(os.getenv("CHUNK_DB_MMAP_BYTES", str(1 << 30)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc_name TEXT,
+    chunk INTEGER,
+    page INTEGER,
+    kind TEXT NOT NULL DEFAULT 'chunk',
+    text TEXT NOT NULL,
+    vector BLOB
+);
+CREATE INDEX IF NOT EXISTS chunks_doc_name ON chunks (doc_name);
+-- Write-ahead log: vectors of chunks that are not yet sealed into a segment file
+CREATE TABLE IF NOT EXISTS wal (
+    id INTEGER PRIMARY KEY,
+    vector BLOB NOT NULL
+);
+-- Manifest of the immutable index segment files that make up the vector index;
+-- `shard` is the document the segment belongs to
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    shard TEXT
+);
+"""
+
+
+class ChunkStore:
+    """
+    Chunk text, metadata and exact vectors in a memory-mapped SQLite database keyed by
+    the stable vector id; also the WAL and segment manifest of the vector index.
+    """
+
+    def __init__(self, path: str = CHUNK_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        if "vector" not in columns:
+            # Databases created before exact vectors were stored next to the text
+            conn.execute("ALTER TABLE chunks ADD COLUMN vector BLOB")
+        if "shard" not in {row[1] for row in conn.execute("PRAGMA table_info(segments)")}:
+            # Segments written before the index was sharded per document hold several documents
+            conn.execute("ALTER TABLE segments ADD COLUMN shard TEXT")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; WAL mode lets readers run alongside the writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def add(self, texts: List[str], metadata: List[dict], vectors: np.ndarray) -> List[int]:
+        """
+        Insert chunks and append their vectors to the WAL in one transaction.
+        Ids are assigned consecutively and never reused.
+        """
+        conn = self._connection()
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with conn:
+            ids = []
+            for text, meta, vector in zip(texts, metadata, vectors):
+                cursor = conn.execute(
+                    "INSERT INTO chunks (doc_name, chunk, page, kind, text, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                    (meta.get("doc_name"), meta.get("chunk"), meta.get("page"), meta.get("kind", "chunk"), text, vector.tobytes())
+                )
+                conn.execute("INSERT INTO wal (id, vector) VALUES (?, ?)", (cursor.lastrowid, vector.tobytes()))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def pending_vectors(self) -> Tuple[np.ndarray, Optional[np.ndarray], List[Optional[str]]]:
+        """(ids, vectors, doc_names) still in the WAL, i.e. not yet part of a committed segment."""
+        rows = self._connection().execute(
+            "SELECT wal.id, wal.vector, chunks.doc_name FROM wal JOIN chunks ON chunks.id = wal.id ORDER BY wal.id"
+        ).fetchall()
+        if not rows:
+            return np.zeros(0, dtype="int64"), None, []
+        ids = np.array([row[0] for row in rows], dtype="int64")
+        return ids, np.vstack([np.frombuffer(row[1], dtype="float32") for row in rows]), [row[2] for row in rows]
+
+    def segments(self) -> List[Tuple[int, str, Optional[str]]]:
+        """(segment id, file, shard) of every committed segment."""
+        return self._connection().execute("SELECT id, file, shard FROM segments ORDER BY id").fetchall()
+
+    def commit_segment(self, file: str, ids: Iterable[int], shard: Optional[str], replaces: Iterable[int] = ()) -> int:
+        """
+        Register a segment file holding `ids` in `shard`, drop those ids from the
+        WAL and unregister the segments it `replaces`, atomically. Returns the segment id.
+        """
+        ids = [int(i) for i in ids]
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("INSERT INTO segments (file, count, shard) VALUES (?, ?, ?)", (file, len(ids), shard))
+            conn.executemany("DELETE FROM wal WHERE id = ?", [(i,) for i in ids])
+            conn.executemany("DELETE FROM segments WHERE id = ?", [(int(s),) for s in replaces])
+        return cursor.lastrowid
+
+    def drop_segments(self, segment_ids: Iterable[int]):
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM segments WHERE id = ?", [(int(s),) for s in segment_ids])
+
+    def import_rows(self, ids: Iterable[int], texts: Iterable[str], metadata: Iterable[dict], vectors: Optional[np.ndarray] = None):
+        """Insert chunks with ids that already exist in the vector index (used for migrations)."""
+        ids = [int(i) for i in ids]
+        blobs = [None] * len(ids) if vectors is None else [v.tobytes() for v in np.ascontiguousarray(vectors, dtype="float32")]
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, doc_name, chunk, page, kind, text, vector) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (i, meta.get("doc_name"), meta.get("chunk"), meta.get("page"), meta.get("kind", "chunk"), text, blob)
+                    for i, text, meta, blob in zip(ids, texts, metadata, blobs)
+                ]
+            )
+
+    def fetch(self, ids: Iterable[int]) -> Dict[int, Tuple[str, dict]]:
+        """Return {id: (text, metadata)} for the given ids; missing ids are left out."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self._connection().execute(
+            f"SELECT id, text, doc_name, chunk, page, kind FROM chunks WHERE id IN ({placeholders})", ids
+        )
+        return {
+            row[0]: (row[1], {"doc_name": row[2], "chunk": row[3], "page": row[4], "kind": row[5]})
+            for row in rows
+        }
+
+    def vectors(self, ids: Iterable[int]) -> Dict[int, np.ndarray]:
+        """Return {id: exact float32 vector} for the given ids; ids without a stored vector are left out."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self._connection().execute(
+            f"SELECT id, vector FROM chunks WHERE vector IS NOT NULL AND id IN ({placeholders})", ids
+        )
+        return {row[0]: np.frombuffer(row[1], dtype="float32") for row in rows}
+
+    def doc_ids(self) -> Dict[Optional[str], np.ndarray]:
+        """Ids of every stored chunk grouped by document, in increasing order."""
+        grouped = {}
+        for chunk_id, doc_name in self._connection().execute("SELECT id, doc_name FROM chunks ORDER BY id"):
+            grouped.setdefault(doc_name, []).append(chunk_id)
+        return {name: np.array(ids, dtype="int64") for name, ids in grouped.items()}
+
+    def drop_shard(self, doc_name: str) -> List[str]:
+        """
+        Delete a document's chunks, WAL entries and segments in one transaction.
+        Returns the segment files that are no longer referenced.
+        """
+        conn = self._connection()
+        with conn:
+            files = [row[0] for row in conn.execute("SELECT file FROM segments WHERE shard = ?", (doc_name,))]
+            conn.execute("DELETE FROM wal WHERE id IN (SELECT id FROM chunks WHERE doc_name = ?)", (doc_name,))
+            conn.execute("DELETE FROM chunks WHERE doc_name = ?", (doc_name,))
+            conn.execute("DELETE FROM segments WHERE shard = ?", (doc_name,))
+        return files
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
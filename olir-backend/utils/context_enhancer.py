@@ -1,9 +1,60 @@
+import os
 import re
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+# Tokens of document context packed into a chat prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# tiktoken encoding used to count tokens; without tiktoken we estimate 4 characters per token
+TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base")
+
+# Header written on every indexed text at ingest (see routers/upload.py build_document_chunks)
+HEADER_RE = re.compile(r'^Document: (?P<doc>.*)\n(?:Chunk (?P<chunk>\d+)/\d+\n+)?')
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable ({e!r}); estimating tokens as characters / 4.")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+def split_header(text: str) -> Tuple[Optional[str], Optional[int], str]:
+    """(document, chunk number, body) of an indexed text; chunk is None for headings and definitions."""
+    match = HEADER_RE.match(text)
+    if not match:
+        return None, None, text.strip()
+    chunk = int(match.group("chunk")) if match.group("chunk") else None
+    return match.group("doc"), chunk, text[match.end():].strip()
+
+def strip_overlap(previous: str, body: str) -> str:
+    """
+    Drop the start of `body` that repeats the end of the chunk before it.
+    smart_chunk_text carries the last sentences of a chunk over as the first
+    paragraph of the next one.
+    """
+    lead, sep, rest = body.partition("\n\n")
+    if sep and lead.strip() and _normalize(previous).endswith(_normalize(lead)):
+        return rest.strip()
+    return body
 
-def enhance_context_for_query(chunks: List[str], query: str) -> str:
+def enhance_context_for_query(chunks: List[str], query: str, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
     """
-    Enhance the context by reordering and formatting chunks based on query relevance
+    Enhance the context by reordering and formatting chunks based on query relevance.
+
+    Chunks are packed greedily, most relevant first, into `token_budget`
+    tokens. Adjacent chunks of the same document are merged into one section
+    without the overlap they share, the per-chunk "Document:/Chunk" headers
+    become one source line per section, and duplicates are dropped.
     """
     # Check if this is a comprehensive query
     is_comprehensive = any(phrase in query.lower() for phrase in [
@@ -21,17 +72,68 @@ def enhance_context_for_query(chunks: List[str], query: str) -> str:
             score += 0.3  # Boost chunks with lists for comprehensive queries
         scored_chunks.append((chunk, score))
 
-    # Sort by relevance score
+    # Sort by relevance score (stable, so retrieval order breaks ties)
     scored_chunks.sort(key=lambda x: x[1], reverse=True)
 
+    # Greedily pack the most relevant chunks into the budget
+    bodies = {}      # (doc, chunk) -> body of the packed chunks of each document
+    packed = []      # (doc, chunk, body) in packing order
+    seen = []
+    used = 0
+    for text, _ in scored_chunks:
+        doc, number, body = split_header(text)
+        normalized = _normalize(re.sub(r'^(Heading|Definition): ', '', body))
+        # Skip exact duplicates, and headings/definitions already inside a packed chunk
+        if not normalized or any(normalized in other for other in seen):
+            continue
+        cost = body
+        if number is not None and (doc, number - 1) in bodies:
+            cost = strip_overlap(bodies[(doc, number - 1)], body)
+        tokens = count_tokens(cost)
+        if number is not None and (doc, number + 1) in bodies:
+            following = bodies[(doc, number + 1)]
+            tokens -= count_tokens(following) - count_tokens(strip_overlap(body, following))
+        if used + tokens > token_budget:
+            continue
+        used += tokens
+        seen.append(normalized)
+        packed.append((doc, number, body))
+        if number is not None:
+            bodies[(doc, number)] = body
+
+    # Merge runs of consecutive chunks of a document into one section, keeping packing order
+    sections = []
+    placed = {}
+    for doc, number, body in packed:
+        if number is None:
+            sections.append([doc, None, None, body])
+            continue
+        if (doc, number) in placed:
+            continue
+        first = number
+        while (doc, first - 1) in bodies:
+            first -= 1
+        last, text = first, bodies[(doc, first)]
+        placed[(doc, first)] = True
+        while (doc, last + 1) in bodies:
+            last += 1
+            text = text + "\n\n" + strip_overlap(bodies[(doc, last - 1)], bodies[(doc, last)])
+            placed[(doc, last)] = True
+        sections.append([doc, first, last, text])
+
     # Format the context with clear separators
     formatted_chunks = []
-    for i, (chunk, score) in enumerate(scored_chunks):
+    for i, (doc, first, last, text) in enumerate(sections):
         # Add section headers for better organization
-        section_header = f"=== DOCUMENT SECTION {i+1} ==="
-        formatted_chunks.append(f"{section_header}\n{chunk}")
+        source = f" | {doc}" if doc else ""
+        if first is not None:
+            source += f", chunk {first}" if first == last else f", chunks {first}-{last}"
+        formatted_chunks.append(f"=== DOCUMENT SECTION {i+1}{source} ===\n{text}")
 
-    return "\n\n".join(formatted_chunks)
+    context = "\n\n".join(formatted_chunks)
+    print(f"📦 Packed {len(packed)}/{len(chunks)} chunks into {len(sections)} sections: "
+          f"{count_tokens(context)} context tokens (budget {token_budget}).")
+    return context
 
 def contains_multiple_items(text: str) -> bool:
     """Check if text contains multiple items (lists, commands, etc.)"""
@@ -87,10 +189,18 @@ def calculate_keyword_overlap(text: str, keywords: List[str]) -> float:
     
     return (matches + partial_matches) / len(keywords)
 
+# Page markers written by utils/processor.py extract_text_from_pdf; the cleanup below would split their digits
+PAGE_MARKER_SPLIT_RE = re.compile(r'(=== Page \d+ ===)')
+
 def preprocess_pdf_text(text: str) -> str:
     """
     Preprocess PDF text to improve extraction quality
     """
+    # Clean the text between page markers, leaving the markers themselves intact
+    parts = PAGE_MARKER_SPLIT_RE.split(text)
+    return ''.join(part if i % 2 else _clean_extracted_text(part) for i, part in enumerate(parts)).strip()
+
+def _clean_extracted_text(text: str) -> str:
     # Fix common PDF extraction issues
     text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)  # Add space between camelCase
     text = re.sub(r'(\w)(\d)', r'\1 \2', text)        # Add space between word and number
@@ -107,7 +217,7 @@ def preprocess_pdf_text(text: str) -> str:
     text = re.sub(r'\bl\b', 'I', text)               # Common OCR error: l -> I
     text = re.sub(r'\b0\b', 'O', text)               # Common OCR error: 0 -> O
     
-    return text.strip()
+    return text
 
 def extract_document_structure(text: str) -> dict:
     """
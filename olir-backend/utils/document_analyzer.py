@@ -1,47 +1,190 @@
-import requests
+import asyncio
+import hashlib
 import os
 import json
+import sqlite3
+import threading
+from utils.context_enhancer import count_tokens
+from utils.llm_client import complete
+from utils.processor import PAGE_MARKER_RE, assign_chunk_pages, smart_chunk_text
 
 # --- Configuration ---
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "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")
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 ANALYSIS_MODEL = "openai/gpt-4o-mini"
 
+# Average number of consecutive ingest chunks summarized together in the first (map) pass
+ANALYSIS_CHUNKS_PER_SECTION = int(os.getenv("ANALYSIS_CHUNKS_PER_SECTION", "4"))
+# Partial summaries are combined in groups of about this size until they fit ANALYSIS_FINAL_TOKENS
+ANALYSIS_REDUCE_FANIN = int(os.getenv("ANALYSIS_REDUCE_FANIN", "8"))
+ANALYSIS_FINAL_TOKENS = int(os.getenv("ANALYSIS_FINAL_TOKENS", "3000"))
+# LLM calls in flight at once for one document
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))
+# Partial summaries by content hash, so re-analysing a document only pays for sections that changed
+ANALYSIS_CACHE_PATH = "data/analysis_cache.db"
+# Bump when the prompts change so cached partials are not reused
+PROMPT_VERSION = "2"
+
+EMPTY_ANALYSIS = {
+    "summary": "Could not generate summary.",
+    "key_points": [],
+    "table_of_contents": []
+}
+
 # --- Helper Function to Call LLM ---
-def _call_llm(payload: dict) -> str:
-    """Generic function to make a call to the OpenRouter API."""
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:5173",
-        "X-Title": "OLIR Chatbot"
+async def _call_llm(payload: dict) -> str:
+    """Generic function to make a call to the OpenRouter API through the shared client."""
+    return await complete(payload, api_key=OPENROUTER_API_KEY)
+
+# --- Partial Summary Cache ---
+_cache_db = None
+_cache_lock = threading.Lock()
+
+def _cache():
+    global _cache_db
+    if _cache_db is None:
+        os.makedirs(os.path.dirname(ANALYSIS_CACHE_PATH), exist_ok=True)
+        _cache_db = sqlite3.connect(ANALYSIS_CACHE_PATH, check_same_thread=False)
+        _cache_db.execute("CREATE TABLE IF NOT EXISTS partials (hash TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+    return _cache_db
+
+def _cache_key(kind: str, text: str) -> str:
+    return hashlib.sha256(f"{ANALYSIS_MODEL}\0{PROMPT_VERSION}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+def _cache_get(key: str):
+    with _cache_lock:
+        row = _cache().execute("SELECT summary FROM partials WHERE hash = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _cache_put(key: str, summary: str):
+    with _cache_lock, _cache():
+        _cache().execute("INSERT OR REPLACE INTO partials (hash, summary) VALUES (?, ?)", (key, summary))
+
+def _pages_label(first, last) -> str:
+    if first is None:
+        return "Pages unknown"
+    return f"Page {first}" if first == last else f"Pages {first}-{last}"
+
+async def _summarize(kind: str, instruction: str, content: str, semaphore: asyncio.Semaphore) -> str:
+    """One cached partial-summary call. Returns None if the LLM call failed (failures are not cached)."""
+    key = _cache_key(kind, content)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    payload = {
+        "model": ANALYSIS_MODEL,
+        "messages": [{"role": "user", "content": f"{instruction}\n\n---\n{content}\n---"}],
+        "temperature": 0.1,
+        "max_tokens": 500
     }
-    
-    response = requests.post(OPENROUTER_URL, headers=headers, json=payload)
-    
-    if response.status_code != 200:
-        print(f"LLM provider error {response.status_code}: {response.text}")
-        return f"Error: LLM provider returned status {response.status_code}"
-        
-    data = response.json()
-    if "choices" in data and data["choices"]:
-        return data["choices"][0]["message"]["content"]
-    else:
-        print(f"LLM response format error: {data}")
-        return "Error: Could not get a valid response from the language model."
-
-def generate_document_analysis(text: str) -> dict:
+    async with semaphore:
+        summary = await _call_llm(payload)
+    if summary.startswith("Error:"):
+        return None
+    summary = summary.strip()
+    _cache_put(key, summary)
+    return summary
+
+def _content_groups(texts: list, size: int) -> list:
     """
-    Generates a structured analysis of the document, including summary, key points, and table of contents.
+    Split consecutive texts into groups of about `size`, ending a group after
+    a text whose hash marks a boundary (or at twice the size). Boundaries
+    depend only on content, so an edit only changes the groups around it and
+    every other group keeps its cache key.
     """
+    groups, current = [], []
+    for index, text in enumerate(texts):
+        current.append(index)
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        if int.from_bytes(digest[:4], "big") % size == 0 or len(current) >= 2 * size:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+def _split_sections(text: str) -> list:
+    """(first_page, last_page, content) of each map-pass section, in document order"""
+    chunks = smart_chunk_text(text, chunk_size=1200, overlap=200)
+    pages = assign_chunk_pages(chunks)
+    # Page markers go into the labels, not the content, so a page added earlier in the document does not change it
+    contents = [PAGE_MARKER_RE.sub("", chunk).strip() for chunk in chunks]
+    sections = []
+    for group in _content_groups(contents, ANALYSIS_CHUNKS_PER_SECTION):
+        section_pages = [pages[i] for i in group if pages[i] is not None]
+        first, last = (section_pages[0], section_pages[-1]) if section_pages else (None, None)
+        sections.append((first, last, "\n\n".join(contents[i] for i in group)))
+    return sections
+
+async def summarize_sections(text: str, semaphore: asyncio.Semaphore) -> list:
+    """
+    Map pass: summarize every section of about ANALYSIS_CHUNKS_PER_SECTION
+    ingest chunks concurrently. Returns (first_page, last_page, summary) per
+    section, in document order, leaving out sections whose call failed.
+    """
+    # Chunking a long document takes a while; keep it off the event loop
+    sections = await asyncio.to_thread(_split_sections, text)
+
+    instruction = (
+        "Summarize this section of a document in 3-5 sentences, then list its key points as bullets. "
+        "Keep names, commands, terms and figures exactly as written."
+    )
+    summaries = await asyncio.gather(*(_summarize("section", instruction, content, semaphore) for _, _, content in sections))
+    return [(first, last, summary) for (first, last, _), summary in zip(sections, summaries) if summary]
+
+async def reduce_summaries(partials: list, semaphore: asyncio.Semaphore) -> list:
+    """Reduce pass: merge consecutive partial summaries ANALYSIS_REDUCE_FANIN at a time until they fit the final prompt."""
+    instruction = (
+        "These are summaries of consecutive parts of one document, with their page ranges. "
+        "Combine them into one summary of 4-6 sentences followed by the most important key points as bullets. "
+        "Mention which pages cover which topics."
+    )
+    while len(partials) > 1 and count_tokens(_render(partials)) > ANALYSIS_FINAL_TOKENS:
+        groups = [[partials[i] for i in group]
+                  for group in _content_groups([summary for _, _, summary in partials], ANALYSIS_REDUCE_FANIN)]
+        merged = await asyncio.gather(*(_summarize("reduce", instruction, _render(group), semaphore)
+                                        for group in groups if len(group) > 1))
+        merged = iter(merged)
+        reduced = []
+        for group in groups:
+            summary = next(merged) if len(group) > 1 else None
+            if summary:
+                reduced.append((group[0][0], group[-1][1], summary))
+            else:
+                # Keep the inputs of a failed merge rather than losing that part of the document
+                reduced.extend(group)
+        if len(reduced) == len(partials):
+            break
+        partials = reduced
+    return partials
+
+def _render(partials: list) -> str:
+    return "\n\n".join(f"[{_pages_label(first, last)}]\n{summary}" for first, last, summary in partials)
+
+async def generate_document_analysis(text: str) -> dict:
+    """
+    Generates a structured analysis of the whole document, including summary, key points, and table of contents.
+
+    Hierarchical map-reduce: sections of the document are summarized
+    concurrently (at most ANALYSIS_CONCURRENCY calls at once), the partial
+    summaries are merged until they fit one prompt, and a final call turns
+    them into the JSON analysis. Partial summaries are cached by the content
+    of their chunks, so re-analysing an edited document reuses the sections
+    the edit did not touch.
+    """
+    semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+    partials = await summarize_sections(text, semaphore)
+    if not partials:
+        return dict(EMPTY_ANALYSIS)
+    partials = await reduce_summaries(partials, semaphore)
+
     analysis_prompt = (
-        "You are a document analysis expert. Your task is to analyze the provided document content and generate a structured JSON output containing a summary, key points, and a table of contents.\n\n"
+        "You are a document analysis expert. Your task is to analyze the provided section summaries of a document and generate a structured JSON output containing a summary, key points, and a table of contents.\n\n"
         "CRITICAL INSTRUCTIONS:\n"
         "1.  **Summary**: Provide a concise summary of the document (4-5 sentences).\n"
         "2.  **Key Points**: Extract the most important topics or conclusions as a list of strings.\n"
-        "3.  **Table of Contents**: Create a table of contents with chapter/section titles and corresponding page ranges (e.g., 'Chapter 1: Introduction, Pages 1-5'). If the document has no clear structure, create a logical one based on the content.\n"
+        "3.  **Table of Contents**: Create a table of contents with chapter/section titles and corresponding page ranges (e.g., 'Chapter 1: Introduction, Pages 1-5'), using the page ranges given with each summary. If the document has no clear structure, create a logical one based on the content.\n"
         "4.  Format the output as a single, clean JSON object with the keys 'summary', 'key_points', and 'table_of_contents'.\n\n"
-        f"DOCUMENT CONTENT (first 4000 characters):\n---\n{text[:4000]}\n---\n\n"
+        f"SECTION SUMMARIES (in document order):\n---\n{_render(partials)}\n---\n\n"
         "JSON OUTPUT:"
     )
     
@@ -53,12 +196,12 @@ def generate_document_analysis(text: str) -> dict:
         "response_format": {"type": "json_object"}
     }
     
-    response_str = _call_llm(payload)
+    response_str = await _call_llm(payload)
     try:
-        return json.loads(response_str)
+        analysis = json.loads(response_str)
     except (json.JSONDecodeError, TypeError):
-        return {
-            "summary": "Could not generate summary.",
-            "key_points": [],
-            "table_of_contents": []
-        }
\ No newline at end of file
+        return dict(EMPTY_ANALYSIS)
+    # The model does not always return the object it was asked for
+    if not isinstance(analysis, dict):
+        return dict(EMPTY_ANALYSIS)
+    return analysis
@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import numpy as np
+import os
+import queue
+import threading
+import traceback
+from utils.embedder import EMBED_BATCH_SIZE, get_embeddings
+
+# Worker threads running the model; torch and ONNX Runtime release the GIL while encoding
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+
+# Concurrent chat queries arriving within this window are embedded in one forward pass (0 = no batching)
+QUERY_WINDOW_MS = float(os.getenv("EMBED_QUERY_WINDOW_MS", "5"))
+QUERY_MAX_BATCH = int(os.getenv("EMBED_QUERY_MAX_BATCH", "32"))
+
+# Lower runs first: chat queries overtake queued ingestion batches
+QUERY = 0
+INGEST = 1
+
+
+class EmbedPool:
+    """
+    Runs embedding off the asyncio event loop on a small pool of worker
+    threads fed by a priority queue.
+
+    Ingestion work is split into EMBED_BATCH_SIZE batches before it is
+    queued, so a chat query waits for at most the batches already running,
+    never for a whole document.
+    """
+
+    def __init__(self, workers: int = EMBED_WORKERS):
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"embed-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            _, _, texts, future, loop = self._queue.get()
+            try:
+                result = get_embeddings(texts)
+                loop.call_soon_threadsafe(_resolve, future, result, None)
+            except Exception as e:
+                print("🔥 EMBED ERROR:", traceback.format_exc())
+                loop.call_soon_threadsafe(_resolve, future, None, e)
+
+    def _submit(self, texts, priority) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((priority, next(self._seq), texts, future, loop))
+        return future
+
+    async def embed(self, texts, priority: int = QUERY) -> np.ndarray:
+        """Embed `texts` on the pool; returns the same (n, dim) float32 matrix as get_embeddings."""
+        texts = list(texts)
+        self._start()
+        if len(texts) <= EMBED_BATCH_SIZE:
+            return await self._submit(texts, priority)
+        batches = [texts[start:start + EMBED_BATCH_SIZE] for start in range(0, len(texts), EMBED_BATCH_SIZE)]
+        results = await asyncio.gather(*(self._submit(batch, priority) for batch in batches))
+        return np.ascontiguousarray(np.vstack(results))
+
+
+class QueryBatcher:
+    """Embeds queries arriving within QUERY_WINDOW_MS of each other in one forward pass."""
+
+    def __init__(self, pool: EmbedPool, window_ms: float = QUERY_WINDOW_MS, max_batch: int = QUERY_MAX_BATCH):
+        self.pool = pool
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+
+    async def embed(self, text: str) -> np.ndarray:
+        if self.window <= 0 or self.max_batch <= 1:
+            return (await self.pool.embed([text], QUERY))[0]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            vectors = await self.pool.embed([text for text, _ in batch], QUERY)
+        except Exception as e:
+            for _, future in batch:
+                _resolve(future, None, e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            _resolve(future, vector, None)
+
+
+def _resolve(future: asyncio.Future, result, error):
+    # The awaiting request may have been cancelled (client went away) in the meantime
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_pool = EmbedPool()
+_batcher = QueryBatcher(_pool)
+
+async def embed(texts, priority: int = QUERY) -> np.ndarray:
+    """Embed texts without blocking the event loop. Use priority=INGEST for bulk document batches."""
+    return await _pool.embed(texts, priority)
+
+async def embed_query(text: str) -> np.ndarray:
+    """Embed one chat query, micro-batched with other concurrent queries."""
+    return await _batcher.embed(text)
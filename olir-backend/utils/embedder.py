@@ -1,14 +1,103 @@
+import numpy as np
 import os
-from sentence_transformers import SentenceTransformer
-import openai
+import threading
 from dotenv import load_dotenv
+from utils.embedding_cache import EmbeddingCache
 
 load_dotenv()
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# "torch", "onnx" (ONNX Runtime) or "onnx-int8" (ONNX Runtime with dynamically int8-quantized weights)
+# The ONNX backends need the extra: pip install "sentence-transformers[onnx]"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# Target instruction set for int8 quantization: "avx2", "avx512", "avx512_vnni" or "arm64"
+EMBED_QUANT_CONFIG = os.getenv("EMBED_QUANT_CONFIG", "avx2")
+ONNX_DIR = "data/onnx_models"
 
-model = SentenceTransformer(EMBED_MODEL)
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Vectors from different backends differ slightly, so each backend gets its own cache namespace
+cache = EmbeddingCache(EMBED_MODEL if EMBED_BACKEND == "torch" else f"{EMBED_MODEL}@{EMBED_BACKEND}")
+
+_model = None
+_model_lock = threading.Lock()
+
+def load_model(backend: str = EMBED_BACKEND):
+    """
+    Build the SentenceTransformer for a backend. The ONNX export (and the
+    int8-quantized copy) are written under ONNX_DIR the first time and reused afterwards.
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(EMBED_MODEL)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND {backend!r}, expected one of {BACKENDS}")
+
+    export_dir = os.path.join(ONNX_DIR, EMBED_MODEL.replace("/", "__"))
+    if not os.path.exists(os.path.join(export_dir, "onnx", "model.onnx")):
+        print(f"ℹ️ Exporting {EMBED_MODEL} to ONNX in {export_dir}")
+        SentenceTransformer(EMBED_MODEL, backend="onnx").save_pretrained(export_dir)
+    if backend == "onnx":
+        return SentenceTransformer(export_dir, backend="onnx")
+
+    quantized = f"onnx/model_qint8_{EMBED_QUANT_CONFIG}.onnx"
+    if not os.path.exists(os.path.join(export_dir, quantized)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        print(f"ℹ️ Quantizing {EMBED_MODEL} to int8 ({EMBED_QUANT_CONFIG})")
+        export_dynamic_quantized_onnx_model(
+            SentenceTransformer(export_dir, backend="onnx"), EMBED_QUANT_CONFIG, export_dir
+        )
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs={"file_name": quantized})
+
+def get_model():
+    """Load the embedding model on first use (importing torch / onnxruntime takes seconds)."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model(EMBED_BACKEND)
+    return _model
+
+def is_model_loaded() -> bool:
+    return _model is not None
 
 def get_embedding(text: str):
-    return model.encode([text])[0]
+    return get_embeddings([text])[0]
+
+def get_embeddings(texts, batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    Embed many texts in batched forward passes. Returns a contiguous (n, dim)
+    float32 matrix in the order of `texts`.
+
+    Texts already in the embedding cache skip the model; the rest are
+    de-duplicated, sorted by length so each batch pads to a similar length,
+    encoded, and added to the cache.
+    """
+    texts = list(texts)
+    cached = cache.get_many(texts)
+    missing = {}
+    for n, (text, vector) in enumerate(zip(texts, cached)):
+        if vector is None:
+            missing.setdefault(text, []).append(n)
+    if not texts:
+        return np.zeros((0, get_model().get_sentence_embedding_dimension()), dtype="float32")
+    if not missing:
+        # Fully cached: the model is not needed (nor loaded)
+        return np.ascontiguousarray(np.vstack(cached), dtype="float32")
+
+    model = get_model()
+    embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype="float32")
+    for n, vector in enumerate(cached):
+        if vector is not None:
+            embeddings[n] = vector
+
+    unique = sorted(missing, key=len, reverse=True)
+    encoded = np.empty((len(unique), embeddings.shape[1]), dtype="float32")
+    for start in range(0, len(unique), batch_size):
+        batch = unique[start:start + batch_size]
+        encoded[start:start + len(batch)] = model.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+    cache.put_many(unique, encoded)
+    for text, vector in zip(unique, encoded):
+        embeddings[missing[text]] = vector
+    return embeddings
@@ -0,0 +1,150 @@
+import hashlib
+import numpy as np
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+CACHE_DIR = "data/embedding_cache"
+# Entries kept in process memory; the disk tier is unbounded and survives restarts
+MEMORY_ENTRIES = int(os.getenv("EMBED_CACHE_MEMORY_ENTRIES", "20000"))
+DISK_ENABLED = os.getenv("EMBED_CACHE_DISK", "1") != "0"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+-- Row of each cached embedding in vectors.f32, keyed by sha256(model + text)
+CREATE TABLE IF NOT EXISTS entries (hash BLOB PRIMARY KEY, row INTEGER NOT NULL);
+"""
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Content-addressed cache of embeddings for one model: an in-memory LRU in front of a memory-mapped disk tier."""
+
+    def __init__(self, model_name: str, cache_dir: str = CACHE_DIR,
+                 memory_entries: int = MEMORY_ENTRIES, disk: bool = DISK_ENABLED):
+        self.model_name = model_name
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._cache_dir = cache_dir if disk else None
+        self._db = None
+        self._dim = None
+        self._mmap = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """The disk tier's index, opened on first use (None if the disk tier is off). Call with the lock held."""
+        if self._db is None and self._cache_dir is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            self._vectors_path = os.path.join(self._cache_dir, "vectors.f32")
+            self._db = sqlite3.connect(os.path.join(self._cache_dir, "index.db"), check_same_thread=False)
+            self._db.executescript(SCHEMA)
+            meta = dict(self._db.execute("SELECT key, value FROM meta"))
+            # Filled by another model (EMBED_MODEL changed): its vectors must never be served
+            if meta.get("model") != self.model_name:
+                self._reset_disk()
+            elif "dim" in meta:
+                self._dim = int(meta["dim"])
+        return self._db
+
+    def _reset_disk(self):
+        if self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]:
+            print(f"ℹ️ Embedding model changed to {self.model_name}; clearing the embedding cache.")
+        with self._db:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM meta")
+            self._db.execute("INSERT INTO meta (key, value) VALUES ('model', ?)", (self.model_name,))
+        open(self._vectors_path, "wb").close()
+        self._mmap = None
+
+    def _disk_rows(self) -> np.ndarray:
+        """Memory map over the on-disk matrix, re-mapped when it has grown."""
+        rows = os.path.getsize(self._vectors_path) // (self._dim * 4)
+        if self._mmap is None or len(self._mmap) < rows:
+            self._mmap = np.memmap(self._vectors_path, dtype="float32", mode="r", shape=(rows, self._dim)) if rows else None
+        return self._mmap
+
+    def get_many(self, texts: Iterable[str]) -> List[Optional[np.ndarray]]:
+        """Cached embedding for each text, or None where it has not been embedded yet."""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        found = [None] * len(keys)
+        with self._lock:
+            missing = []
+            for n, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[n] = vector
+                    self.stats["memory_hits"] += 1
+                else:
+                    missing.append(n)
+
+            if missing and self._disk() is not None and self._dim is not None:
+                rows = self._lookup_rows({keys[n] for n in missing})
+                matrix = self._disk_rows() if rows else None
+                for n in missing:
+                    row = rows.get(keys[n])
+                    if row is not None and matrix is not None and row < len(matrix):
+                        found[n] = np.array(matrix[row])
+                        self._remember(keys[n], found[n])
+                        self.stats["disk_hits"] += 1
+
+            self.stats["misses"] += sum(vector is None for vector in found)
+        return found
+
+    def _lookup_rows(self, keys) -> Dict[bytes, int]:
+        keys = list(keys)
+        rows = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.update(self._db.execute(f"SELECT hash, row FROM entries WHERE hash IN ({placeholders})", batch))
+        return rows
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Store freshly computed embeddings in both tiers."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        keys = [cache_key(self.model_name, text) for text in texts]
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector.copy())
+            if self._disk() is None or not len(vectors):
+                return
+
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(self._dim),))
+            # Rows are numbered by file size, so a crash between the append and the commit only leaves unused rows
+            first_row = os.path.getsize(self._vectors_path) // (self._dim * 4)
+            with open(self._vectors_path, "r+b") as f:
+                f.seek(first_row * self._dim * 4)
+                f.write(vectors.tobytes())
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO entries (hash, row) VALUES (?, ?)",
+                    [(key, first_row + n) for n, key in enumerate(keys)]
+                )
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = sum(stats.values())
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            stats["memory_entries"] = len(self._memory)
+            db = self._disk()
+            stats["disk_entries"] = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] if db else 0
+            stats["model"] = self.model_name
+        return stats
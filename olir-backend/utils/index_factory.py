@@ -0,0 +1,226 @@
+import numpy as np
+import os
+import time
+from typing import List, Optional
+from utils.lazy import lazy_import
+
+faiss = lazy_import("faiss")
+
+# --- Configuration ---
+# "auto" stays exact (flat) for small corpora and switches to VECTOR_ANN_TIER past VECTOR_ANN_THRESHOLD vectors
+INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "auto")
+ANN_TIER = os.getenv("VECTOR_ANN_TIER", "hnsw")
+ANN_THRESHOLD = int(os.getenv("VECTOR_ANN_THRESHOLD", "50000"))
+
+IVF_NLIST = int(os.getenv("VECTOR_IVF_NLIST", "0"))  # 0 = derive from corpus size
+IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))
+
+# How vectors are stored inside an index: raw float32 ("none"), float16, 8-bit scalar quantization or product quantization
+COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none")
+PQ_M = int(os.getenv("VECTOR_PQ_M", "48"))  # sub-quantizers (bytes per vector); must divide the dimension
+# Searches over compressed segments fetch this many times k candidates and re-rank them on exact vectors (0 = off)
+RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+
+TIERS = ("flat", "ivf", "hnsw")
+COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+# PQ trains 256 centroids per sub-quantizer; below this many vectors segments fall back to sq8
+PQ_MIN_TRAIN = 39 * 256
+# Quantizers are trained on at most this many vectors; more only slows down ingest and merges
+MAX_TRAIN = 64 * 256
+
+
+def choose_tier(count: int) -> str:
+    """Pick the index tier for a corpus of `count` vectors."""
+    if INDEX_TYPE in TIERS:
+        return INDEX_TYPE
+    return ANN_TIER if count >= ANN_THRESHOLD else "flat"
+
+def index_tier(index) -> str:
+    """Tier of an index (or of the index wrapped by an IndexIDMap2)."""
+    if isinstance(index, faiss.IndexIDMap2):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def index_compression(index) -> str:
+    """Vector encoding of an index (or of the index wrapped by an IndexIDMap2)."""
+    if isinstance(index, faiss.IndexIDMap2):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+def _storage_spec(compression: str) -> str:
+    """index_factory code encoding for a compression setting."""
+    return {"none": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{PQ_M}"}[compression]
+
+def _ivf_nlist(count: int, train_count: int) -> int:
+    # ~4*sqrt(n) lists, but keep at least 39 training points per centroid (training uses at most MAX_TRAIN vectors)
+    nlist = IVF_NLIST or int(4 * np.sqrt(count))
+    return max(1, min(nlist, train_count // 39))
+
+def build_index(vectors, ids, tier: Optional[str] = None, compression: Optional[str] = None):
+    """
+    Build an IndexIDMap2 over `vectors` with the given stable `ids`.
+
+    IVF indexes are trained on the vectors and keep a direct map so stored
+    vectors can still be reconstructed for rebuilds and filtered searches.
+    Compressed encodings (sq8/pq) are trained on the same vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    dim = vectors.shape[1]
+    tier = tier or choose_tier(len(vectors))
+    if tier == "ivf" and len(vectors) < 39:
+        # Too few vectors to train even one list (e.g. a small document in a large corpus)
+        tier = "flat"
+    compression = compression or COMPRESSION
+    if compression == "pq" and len(vectors) < PQ_MIN_TRAIN:
+        compression = "sq8"
+    storage = _storage_spec(compression)
+
+    sample = vectors
+    if len(vectors) > MAX_TRAIN:
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), MAX_TRAIN, replace=False)]
+
+    if compression == "pq" and tier != "ivf":
+        # IndexPQ cannot take IDSelectors, so exact PQ scans go through a single-list IVF;
+        # HNSW links (2*M ints per vector) would outweigh the PQ codes, so that tier uses IVF-PQ too
+        nlist = 1 if tier == "flat" else _ivf_nlist(len(vectors), len(sample))
+        tier = "ivf"
+    else:
+        nlist = _ivf_nlist(len(vectors), len(sample))
+
+    if tier == "ivf":
+        index = faiss.index_factory(dim, f"IDMap2,IVF{nlist},{storage}")
+        index.train(sample)
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = max(1, min(IVF_NPROBE, nlist))
+        ivf.make_direct_map()
+    elif tier == "hnsw":
+        index = faiss.index_factory(dim, f"IDMap2,HNSW{HNSW_M}" + ("" if storage == "Flat" else f",{storage}"))
+        hnsw = faiss.downcast_index(index.index)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        index = faiss.index_factory(dim, f"IDMap2,{storage}")
+
+    if not index.is_trained:
+        index.train(sample)
+    if len(vectors):
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    return index
+
+def search_params(tier: str, selector=None, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Query-time parameters for a tier: nprobe for IVF, efSearch for HNSW, plus an optional IDSelector."""
+    if tier == "ivf":
+        params = faiss.SearchParametersIVF(nprobe=nprobe or IVF_NPROBE)
+    elif tier == "hnsw":
+        params = faiss.SearchParametersHNSW(efSearch=ef_search or HNSW_EF_SEARCH)
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+def rerank(query, candidate_ids, candidate_vectors, k: int):
+    """Exact squared-L2 top-k of one query among candidate vectors. Returns (distances, ids)."""
+    query = np.asarray(query, dtype="float32").reshape(-1)
+    distances = ((np.asarray(candidate_vectors, dtype="float32") - query) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind="stable")[:k]
+    return distances[order], np.asarray(candidate_ids)[order]
+
+def index_bytes(index) -> int:
+    """Serialized size of an index, a close proxy for its resident memory."""
+    return faiss.serialize_index(index).nbytes
+
+
+def compare_index_tiers(vectors, queries, k: int = 10,
+                        nprobes: List[int] = (1, 4, 16, 64),
+                        ef_searches: List[int] = (16, 32, 64, 128)) -> List[dict]:
+    """
+    Measure recall@k and per-query latency of IVF and HNSW settings against
+    exact flat search on the same vectors. Returns one row per configuration.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    ids = np.arange(len(vectors), dtype="int64")
+    k = min(k, len(vectors))
+
+    def timed_search(index, params):
+        start = time.perf_counter()
+        _, I = index.search(queries, k, params=params)
+        return I, (time.perf_counter() - start) * 1000 / len(queries)
+
+    rows = []
+    flat = build_index(vectors, ids, "flat")
+    truth, latency = timed_search(flat, search_params("flat"))
+    rows.append({"tier": "flat", "setting": "-", "recall": 1.0, "ms_per_query": latency, "build_s": 0.0})
+
+    for tier, knob, values in (("ivf", "nprobe", nprobes), ("hnsw", "efSearch", ef_searches)):
+        start = time.perf_counter()
+        index = build_index(vectors, ids, tier)
+        build_s = time.perf_counter() - start
+        for value in values:
+            params = search_params(tier, nprobe=value) if tier == "ivf" else search_params(tier, ef_search=value)
+            found, latency = timed_search(index, params)
+            hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+            rows.append({
+                "tier": tier,
+                "setting": f"{knob}={value}",
+                "recall": hits / truth.size,
+                "ms_per_query": latency,
+                "build_s": build_s
+            })
+    return rows
+
+def compare_compression(vectors, queries, k: int = 10, tier: str = "flat",
+                        compressions: List[str] = COMPRESSIONS, rerank_factor: int = RERANK_FACTOR) -> List[dict]:
+    """
+    Measure memory per million vectors and recall@k of each compression
+    setting against exact float32 search, with and without re-ranking the top
+    `rerank_factor * k` candidates on exact vectors. Returns one row per setting.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    ids = np.arange(len(vectors), dtype="int64")
+    k = min(k, len(vectors))
+    _, truth = build_index(vectors, ids, "flat", "none").search(queries, k)
+
+    def recall(found):
+        return sum(len(set(f) & set(t)) for f, t in zip(found, truth)) / truth.size
+
+    rows = []
+    for compression in compressions:
+        start = time.perf_counter()
+        index = build_index(vectors, ids, tier, compression)
+        build_s = time.perf_counter() - start
+        fetch = min(len(vectors), k * max(1, rerank_factor))
+
+        start = time.perf_counter()
+        _, candidates = index.search(queries, fetch)
+        latency = (time.perf_counter() - start) * 1000 / len(queries)
+        reranked = [
+            rerank(query, found[found >= 0], vectors[found[found >= 0]], k)[1]
+            for query, found in zip(queries, candidates)
+        ]
+        rows.append({
+            "compression": compression,
+            "effective": index_compression(index),
+            "tier": index_tier(index),
+            "mb_per_million": index_bytes(index) / len(vectors) * 1e6 / 2 ** 20,
+            "recall": recall(candidates[:, :k]),
+            "recall_reranked": recall(reranked),
+            "ms_per_query": latency,
+            "build_s": build_s
+        })
+    return rows
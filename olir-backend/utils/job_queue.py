@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+JOBS_DB_PATH = "data/jobs.db"
+
+# How many jobs run at once; the rest wait in the queue
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Runs a job gets, counting restarts that cut it short, before it is marked failed
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    source TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    -- JSON object of seconds spent in each finished stage
+    timings TEXT NOT NULL DEFAULT '{}',
+    -- JSON object the handler returned
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class JobProgress:
+    """Handed to a job's handler to report which stage it is in and how far along that stage is."""
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.timings = {}
+        self.current = None
+        self._offset = 0.0
+        self._weight = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        self.current = name
+        self._offset = 0.0
+        for stage, weight in self.queue.stages:
+            if stage == name:
+                self._weight = weight
+                break
+            self._offset += weight
+        self.queue._update(self.job_id, stage=name, progress=round(self._offset, 4))
+        start_time = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timings[name] = round(time.perf_counter() - start_time, 3)
+            self.queue._update(self.job_id, timings=json.dumps(self.timings),
+                               progress=round(self._offset + self._weight, 4))
+
+    def update(self, fraction: float):
+        """How much of the current stage is done, from 0 to 1"""
+        fraction = min(max(fraction, 0.0), 1.0)
+        self.queue._update(self.job_id, progress=round(self._offset + self._weight * fraction, 4))
+
+
+class JobQueue:
+    """
+    Background jobs run by a pool of asyncio workers and recorded in a SQLite ledger that survives restarts.
+    `stages` lists (name, weight) pairs whose weights add up to 1.
+    """
+
+    def __init__(self, handler: Callable[[dict, JobProgress], Awaitable[Optional[dict]]],
+                 stages: Sequence[Tuple[str, float]], path: str = JOBS_DB_PATH, workers: int = INGEST_WORKERS,
+                 max_attempts: int = INGEST_MAX_ATTEMPTS):
+        self.handler = handler
+        self.stages = list(stages)
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._tasks = []
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """The ledger, opened on first use. Call with the lock held."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _update(self, job_id: str, **fields):
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._connection().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _row(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["timings"] = json.loads(job["timings"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def start(self):
+        """Start the workers on the running event loop, re-queueing whatever a previous process left unfinished"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        with self._lock:
+            exhausted = self._connection().execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND attempts >= ?",
+                (FAILED, f"Gave up after {self.max_attempts} attempts", _now(), RUNNING, self.max_attempts)
+            ).rowcount
+            unfinished = self._connection().execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+            self._connection().execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+        for row in unfinished:
+            self._queue.put_nowait(row["id"])
+        if exhausted:
+            print(f"⚠️ Gave up on {exhausted} job(s) interrupted {self.max_attempts} times")
+        if unfinished:
+            print(f"🔁 Re-queued {len(unfinished)} unfinished job(s)")
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; jobs they were running stay `running` in the ledger and resume on the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, filename: str, source: str = None) -> dict:
+        """Record a job in the ledger and queue it; returns the job as stored"""
+        # Start first, so the new job is not also picked up as left over from a previous process
+        self.start()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO jobs (id, kind, filename, source, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, filename, source, QUEUED, _now())
+            )
+        self._queue.put_nowait(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, limit: int = 100, status: str = None) -> List[dict]:
+        """Most recent jobs first"""
+        query, params = "SELECT * FROM jobs", ()
+        if status:
+            query, params = query + " WHERE status = ?", (status,)
+        with self._lock:
+            rows = self._connection().execute(query + " ORDER BY created_at DESC LIMIT ?", (*params, limit)).fetchall()
+        return [self._row(row) for row in rows]
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                continue
+            job["attempts"] += 1
+            self._update(job_id, status=RUNNING, attempts=job["attempts"], started_at=_now(),
+                         error=None, progress=0.0, timings="{}")
+            progress = JobProgress(self, job_id)
+            try:
+                result = await self.handler(job, progress)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"🔥 JOB {job_id} FAILED in {progress.current or 'setup'}:", traceback.format_exc())
+                self._update(job_id, status=FAILED, error=str(e) or type(e).__name__, finished_at=_now())
+                continue
+            self._update(job_id, status=COMPLETED, stage=None, progress=1.0, finished_at=_now(),
+                         result=json.dumps(result) if result is not None else None)
+            print(f"✅ Job {job_id} ({job['filename']}) done: {progress.timings}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "workers": self.workers,
+            "waiting": self._queue.qsize() if self._queue else 0,
+            **{status: counts.get(status, 0) for status in (QUEUED, RUNNING, COMPLETED, FAILED)}
+        }
@@ -0,0 +1,23 @@
+import importlib
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """
+    Return module `name` without executing it yet: the real import runs on
+    first attribute access. Keeps heavy native libraries (faiss) off the
+    server's startup path until a request or the warm-up actually needs them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        # Let the normal import raise the usual ModuleNotFoundError
+        return importlib.import_module(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,366 @@
+import asyncio
+import httpx
+import json
+import os
+import random
+import time
+from collections import deque
+
+# --- Configuration ---
+# Point OPENROUTER_URL at benchmarks/fake_openrouter.py to run without network access or an API key
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+# Requests allowed in flight to the provider at once; the rest wait their turn instead of piling onto it
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+# Latency budget of one call, retries and hedges included (a stream must finish within it)
+DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+# Retries of failures where the provider did not process the request: 429/502/503/504 and connection errors
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+RETRY_BASE_MS = float(os.getenv("LLM_RETRY_BASE_MS", "250"))
+RETRY_MAX_MS = float(os.getenv("LLM_RETRY_MAX_MS", "4000"))
+RETRY_STATUSES = {429, 502, 503, 504}
+# Hedging: if a completion is still running after the p95 of recent latencies, send a second one and take the first answer
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Circuit breaker: after this many provider failures in a row, fail fast for the cooldown, then let one call test it
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "http://localhost:5173",
+    "X-Title": "OLIR Chatbot"
+}
+
+
+class LLMError(Exception):
+    """
+    The provider answered with an error status, or could not be reached (504
+    timeout / 502 connection error / 503 circuit open). `retryable` marks
+    failures where the request was not processed and may be sent again.
+    """
+
+    def __init__(self, status_code: int, body: str, retryable: bool = False, retry_after: float = None):
+        super().__init__(f"LLM provider error {status_code}")
+        self.status_code = status_code
+        self.body = body
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Rejects calls for `cooldown` seconds after `failures` provider failures in a row, then lets one trial call through."""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._trial or time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if not self._trial and time.monotonic() - self._opened_at >= self.cooldown:
+            self._trial = True
+            return True
+        return False
+
+    def record(self, ok: bool):
+        if ok:
+            if self._opened_at is not None:
+                print("✅ LLM provider recovered; circuit closed.")
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial = False
+            return
+        self._consecutive += 1
+        if self._trial or self._consecutive >= self.failures:
+            if self._opened_at is None or self._trial:
+                print(f"⚠️ LLM provider failing ({self._consecutive} in a row); circuit open for {self.cooldown:.0f}s.")
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    def abandon(self):
+        """The trial call ended without an outcome (cancelled, or an unreadable response): count it as failed."""
+        if self._trial:
+            self.record(False)
+
+
+class LatencyTracker:
+    """Latencies of recent successful completions, for the hedging delay."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_client = None
+_semaphore = None
+_breaker = CircuitBreaker()
+_latencies = LatencyTracker()
+_stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0, "rejected_open": 0}
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    The process-wide AsyncClient. Connections to the provider are kept alive
+    and reused across requests, so a chat turn does not pay TCP + TLS setup.
+    """
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            headers=DEFAULT_HEADERS
+        )
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _client
+
+async def close_client():
+    global _client, _semaphore
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _semaphore = None
+
+def _auth(api_key):
+    return {"Authorization": f"Bearer {api_key or OPENROUTER_API_KEY}"}
+
+def _status_error(response: httpx.Response, body: str) -> LLMError:
+    retry_after = response.headers.get("Retry-After")
+    try:
+        retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        retry_after = None
+    return LLMError(response.status_code, body, retryable=response.status_code in RETRY_STATUSES, retry_after=retry_after)
+
+def _transport_error(e: Exception) -> LLMError:
+    # Nothing reached the provider if the connection could not be set up, so those are safe to resend
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return LLMError(502, f"Connection error: {e!r}", retryable=True)
+    if isinstance(e, httpx.TimeoutException):
+        return LLMError(504, f"Timed out: {e!r}")
+    return LLMError(502, f"Connection error: {e!r}")
+
+def _backoff(attempt: int, error: LLMError) -> float:
+    """Seconds to wait before retry `attempt` (0-based): full jitter, or the provider's Retry-After."""
+    if error.retry_after is not None:
+        return error.retry_after
+    return random.uniform(0, min(RETRY_MAX_MS, RETRY_BASE_MS * 2 ** attempt)) / 1000
+
+def _check_breaker() -> bool:
+    """Raise while the circuit is open; True if this call is the half-open trial."""
+    if not _breaker.allow():
+        _stats["rejected_open"] += 1
+        raise LLMError(503, "Circuit open: the LLM provider is failing, not calling it for now")
+    return _breaker.state == "half-open"
+
+def _record(error: LLMError = None) -> bool:
+    # Only failures of the provider itself count against the breaker, not rejected requests (400, 401, ...)
+    _breaker.record(error is None or not (error.retryable or error.status_code >= 500))
+    # The outcome is recorded, so the call no longer holds a trial
+    return False
+
+
+async def _attempt(payload: dict, api_key: str) -> dict:
+    """One POST to the provider."""
+    client = get_client()
+    async with _semaphore:
+        start = time.monotonic()
+        try:
+            response = await client.post(OPENROUTER_URL, json=payload, headers=_auth(api_key))
+        except httpx.TransportError as e:
+            raise _transport_error(e)
+    if response.status_code != 200:
+        raise _status_error(response, response.text)
+    _latencies.add(time.monotonic() - start)
+    return response.json()
+
+async def _hedged(payload: dict, api_key: str) -> dict:
+    """
+    _attempt, plus a second identical request if the first is still running
+    after the p95 latency; the first success wins and the other is cancelled.
+    """
+    delay = _latencies.percentile(0.95) if HEDGE_ENABLED else None
+    if delay is None:
+        return await _attempt(payload, api_key)
+
+    tasks = [asyncio.ensure_future(_attempt(payload, api_key))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            _stats["hedges"] += 1
+            tasks.append(asyncio.ensure_future(_attempt(payload, api_key)))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        _stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def chat_completion(payload: dict, api_key: str = None, deadline: float = None) -> dict:
+    """
+    POST a chat completion and return the parsed JSON response. Raises LLMError on failure.
+
+    The call is bounded by `deadline` seconds (LLM_DEADLINE_SECONDS), retried
+    with jittered exponential backoff on retryable failures while the budget
+    lasts, optionally hedged, and rejected at once while the circuit is open.
+    """
+    deadline = deadline or DEADLINE_SECONDS
+    expires = time.monotonic() + deadline
+    _stats["calls"] += 1
+    attempt = 0
+    trial = False
+    try:
+        while True:
+            trial = _check_breaker()
+            try:
+                data = await asyncio.wait_for(_hedged(payload, api_key), max(0.0, expires - time.monotonic()))
+            except asyncio.TimeoutError:
+                _stats["deadline_exceeded"] += 1
+                trial = _record(LLMError(504, "deadline"))
+                raise LLMError(504, f"No response within the {deadline:.0f}s deadline")
+            except LLMError as e:
+                trial = _record(e)
+                delay = _backoff(attempt, e)
+                if not e.retryable or attempt >= MAX_RETRIES or time.monotonic() + delay >= expires:
+                    raise
+                _stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            trial = _record()
+            return data
+    finally:
+        # A trial cut short by cancellation or a malformed response must not leave the breaker half-open
+        if trial:
+            _breaker.abandon()
+
+async def stream_completion(payload: dict, api_key: str = None, deadline: float = None):
+    """
+    Stream a chat completion (`stream: true`), yielding content deltas as the
+    provider emits them. Raises LLMError on failure, including an error the
+    provider reports mid-stream.
+
+    The whole stream is bounded by `deadline` seconds. Retryable failures are
+    retried like chat_completion as long as nothing has been yielded yet;
+    streams are never hedged.
+    """
+    deadline = deadline or DEADLINE_SECONDS
+    expires = time.monotonic() + deadline
+    _stats["calls"] += 1
+    client = get_client()
+    attempt = 0
+    yielded = False
+    trial = False
+    try:
+        while True:
+            trial = _check_breaker()
+            try:
+                async with _semaphore:
+                    request = client.build_request("POST", OPENROUTER_URL, json={**payload, "stream": True}, headers=_auth(api_key))
+                    try:
+                        response = await asyncio.wait_for(client.send(request, stream=True), max(0.0, expires - time.monotonic()))
+                    except httpx.TransportError as e:
+                        raise _transport_error(e)
+                    try:
+                        if response.status_code != 200:
+                            body = await response.aread()
+                            raise _status_error(response, body.decode("utf-8", errors="replace"))
+                        lines = response.aiter_lines()
+                        while True:
+                            try:
+                                line = await asyncio.wait_for(lines.__anext__(), max(0.0, expires - time.monotonic()))
+                            except StopAsyncIteration:
+                                break
+                            except httpx.TransportError as e:
+                                raise _transport_error(e)
+                            # SSE: skip blank separators and comments (OpenRouter sends ": OPENROUTER PROCESSING" keep-alives)
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            if "error" in chunk:
+                                error = chunk["error"]
+                                raise LLMError(int(error.get("code") or 502), json.dumps(error))
+                            for choice in chunk.get("choices", []):
+                                text = (choice.get("delta") or {}).get("content")
+                                if text:
+                                    yielded = True
+                                    yield text
+                    finally:
+                        await response.aclose()
+            except asyncio.TimeoutError:
+                _stats["deadline_exceeded"] += 1
+                trial = _record(LLMError(504, "deadline"))
+                raise LLMError(504, f"No complete response within the {deadline:.0f}s deadline")
+            except LLMError as e:
+                trial = _record(e)
+                delay = _backoff(attempt, e)
+                if yielded or not e.retryable or attempt >= MAX_RETRIES or time.monotonic() + delay >= expires:
+                    raise
+                _stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            trial = _record()
+            return
+    finally:
+        # A trial the client walked away from (or that failed to parse) must not leave the breaker half-open
+        if trial:
+            _breaker.abandon()
+
+
+async def complete(payload: dict, api_key: str = None, deadline: float = None) -> str:
+    """Return the text of a chat completion, or an 'Error: ...' string (the convention of the analysis helpers)."""
+    try:
+        data = await chat_completion(payload, api_key, deadline)
+    except LLMError as e:
+        print(f"LLM provider error {e.status_code}: {e.body}")
+        return f"Error: LLM provider returned status {e.status_code}"
+    if "choices" in data and data["choices"]:
+        return data["choices"][0]["message"]["content"]
+    print(f"LLM response format error: {data}")
+    return "Error: Could not get a valid response from the language model."
+
+def get_stats() -> dict:
+    """Call counters, latency percentiles and circuit state, for /status/llm."""
+    p50, p95 = _latencies.percentile(0.5), _latencies.percentile(0.95)
+    return {
+        **_stats,
+        "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        "hedging": HEDGE_ENABLED,
+        "circuit": _breaker.state
+    }
@@ -1,17 +1,34 @@
 import re
-from PyPDF2 import PdfReader
 import os
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extract text from PDF with better formatting"""
+def extract_text_from_pdf(file_path: str, on_page=None) -> str:
+    """Extract text from PDF with better formatting; on_page(done, total) is called after each page"""
+    from PyPDF2 import PdfReader  # imported on first use to keep it off the startup path
     reader = PdfReader(file_path)
     text = ""
     for page_num, page in enumerate(reader.pages):
         page_text = page.extract_text()
         # Add page number for reference
         text += f"\n=== Page {page_num + 1} ===\n{page_text}\n"
+        if on_page:
+            on_page(page_num + 1, len(reader.pages))
     return text
 
+PAGE_MARKER_RE = re.compile(r'=== Page (\d+) ===')
+
+def assign_chunk_pages(chunks: list) -> list:
+    """Return the page each chunk starts on, based on the page markers added by extract_text_from_pdf"""
+    pages = []
+    current_page = None
+    for chunk in chunks:
+        markers = [int(m) for m in PAGE_MARKER_RE.findall(chunk)]
+        if current_page is None and markers:
+            current_page = markers[0]
+        pages.append(current_page)
+        if markers:
+            current_page = markers[-1]
+    return pages
+
 def smart_chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> list:
     """
     Create intelligent text chunks that respect paragraph and sentence boundaries
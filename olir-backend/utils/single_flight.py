@@ -0,0 +1,38 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Hashable
+
+
+def normalize_question(text: str) -> str:
+    """Case, whitespace and trailing punctuation do not make two questions different."""
+    return re.sub(r'\s+', ' ', text.lower()).strip().rstrip('?.! ')
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one run of the work; nothing is kept once it finishes."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable]):
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["followers"] += 1
+        else:
+            self.stats["leaders"] += 1
+            future = asyncio.ensure_future(work())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # A caller that disconnects does not cancel the work for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Mark the exception retrieved even if every caller went away before it was raised
+        if not future.cancelled():
+            future.exception()
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "in_flight": len(self._inflight)}
@@ -1,2 +0,0 @@
-# utils/training_memory.py
-training_sessions = []
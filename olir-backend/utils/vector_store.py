@@ -1,91 +1,498 @@
-import faiss
+import heapq
+import json
 import numpy as np
 import os
 import pickle
+import re
+import threading
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from utils.chunk_store import ChunkStore
+from utils.index_factory import RERANK_FACTOR, build_index, choose_tier, index_compression, index_tier, rerank, search_params
+from utils.lazy import lazy_import
+from utils.processor import PAGE_MARKER_RE
 
+faiss = lazy_import("faiss")
+
+SEGMENTS_DIR = "data/faiss_index/segments"
+# Single-file index and chunk list written by older versions; only read once to migrate them
 INDEX_PATH = "data/faiss_index/index.faiss"
 DOCS_PATH = "data/faiss_index/docs.pkl"
-def save_faiss_index(index, docs):
-    # ✅ Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+META_PATH = "data/faiss_index/meta.json"
+# Deletes recorded against shared segments before the index was sharded per document
+TOMBSTONES_PATH = "data/faiss_index/tombstones.json"
 
-    faiss.write_index(index, INDEX_PATH)
-    with open(DOCS_PATH, "wb") as f:
-        pickle.dump(docs, f)
+# Merge the VECTOR_MERGE_FACTOR smallest segments of a shard whenever it has more than VECTOR_MAX_SEGMENTS
+MAX_SEGMENTS = int(os.getenv("VECTOR_MAX_SEGMENTS", "8"))
+MERGE_FACTOR = int(os.getenv("VECTOR_MERGE_FACTOR", "4"))
+# Threads used to search shards concurrently for unfiltered queries (1 = search them inline)
+SEARCH_THREADS = int(os.getenv("VECTOR_SEARCH_THREADS", str(min(8, os.cpu_count() or 1))))
 
-def load_faiss_index(doc_filter=None):
-    """Load FAISS index and documents. Returns (index, docs) or (None, []) if not found."""
-    if not os.path.exists(INDEX_PATH) or not os.path.exists(DOCS_PATH):
-        return None, []
-    
-    try:
-        index = faiss.read_index(INDEX_PATH)
+CHUNK_HEADER_RE = re.compile(r'^Document: (?P<doc>.*)\n(?:Chunk (?P<chunk>\d+)/\d+|(?P<kind>Heading|Definition):)')
+
+def _replace_file(path, write):
+    """Write to a temp file and atomically move it over `path`."""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_metadata(count):
+    """Load per-chunk metadata, padded with None for chunks indexed before metadata existed."""
+    meta = []
+    if os.path.exists(META_PATH):
+        try:
+            with open(META_PATH, "r") as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"Error loading chunk metadata: {e}")
+    meta = meta[:count]
+    return meta + [None] * (count - len(meta))
+
+def metadata_from_text(text: str) -> dict:
+    """Recover chunk metadata from the 'Document: ...' header written at ingest (for legacy chunks)."""
+    match = CHUNK_HEADER_RE.match(text)
+    if not match:
+        return {"doc_name": None, "chunk": None, "page": None, "kind": "chunk"}
+    page = PAGE_MARKER_RE.search(text)
+    return {
+        "doc_name": match.group("doc"),
+        "chunk": int(match.group("chunk")) if match.group("chunk") else None,
+        "page": int(page.group(1)) if page else None,
+        "kind": match.group("kind").lower() if match.group("kind") else "chunk"
+    }
+
+
+def _migrate_legacy_index(chunk_store: ChunkStore):
+    """
+    One-time import of the single-file layout: index.faiss becomes an
+    unsharded segment (split per document right after) and docs.pkl /
+    meta.json (aligned with its storage order) move into the chunk store.
+    """
+    index = faiss.read_index(INDEX_PATH)
+    storage = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    vectors = storage.reconstruct_n(0, storage.ntotal) if storage.ntotal else np.zeros((0, index.d), dtype="float32")
+    if not isinstance(index, faiss.IndexIDMap2):
+        # Indexes written before stable ids were plain flat indexes numbered by position
+        index = build_index(vectors, np.arange(len(vectors), dtype="int64"))
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
+
+    if os.path.exists(DOCS_PATH) and chunk_store.count() == 0:
         with open(DOCS_PATH, "rb") as f:
             docs = pickle.load(f)
-        
-        # Apply document filter if specified
+        metadata = [meta or metadata_from_text(doc) for meta, doc in zip(load_metadata(len(docs)), docs)]
+        chunk_store.import_rows(ids, docs, metadata, vectors)
+        os.replace(DOCS_PATH, DOCS_PATH + ".migrated")
+
+    if index.ntotal:
+        _write_segment(chunk_store, index, ids, shard=None)
+    os.replace(INDEX_PATH, INDEX_PATH + ".migrated")
+    print(f"ℹ️ Migrated {index.ntotal} vectors from {INDEX_PATH} to the segmented index.")
+
+
+class SearchHit(NamedTuple):
+    id: int
+    text: str
+    distance: float
+    metadata: dict
+
+
+@dataclass(frozen=True)
+class Segment:
+    """
+    One immutable index segment: an IndexIDMap2 (flat, IVF or HNSW, see
+    utils.index_factory) over a sorted run of stable ids from one shard.
+    """
+    segment_id: int
+    file: str
+    index: "faiss.Index"
+    ids: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    @property
+    def tier(self) -> str:
+        return index_tier(self.index)
+
+    @property
+    def compressed(self) -> bool:
+        return index_compression(self.index) != "none"
+
+    def vectors(self) -> np.ndarray:
+        """Reconstruct the stored vectors, in storage order (aligned with `ids`)."""
+        storage = faiss.downcast_index(self.index.index)
+        return storage.reconstruct_n(0, storage.ntotal)
+
+    def search(self, query, k, nprobe=None, ef_search=None):
+        """Search this segment. Returns (distances, ids)."""
+        storage = faiss.downcast_index(self.index.index)
+        params = search_params(self.tier, nprobe=nprobe, ef_search=ef_search)
+        D, I = storage.search(query, min(k, len(self.ids)), params=params)
+        found = I[0] >= 0
+        return D[0][found], self.ids[I[0][found]]
+
+
+def _load_segment(segment_id, file) -> Segment:
+    index = faiss.read_index(os.path.join(SEGMENTS_DIR, file))
+    return Segment(segment_id, file, index, faiss.vector_to_array(index.id_map).astype("int64"))
+
+def _write_segment(chunk_store: ChunkStore, index, ids, shard, replaces=()) -> Segment:
+    """
+    Write a segment file and commit it to the manifest. The file is fully
+    written before the manifest row exists, so a crash leaves at worst an
+    unreferenced file (removed on the next start) and the vectors still in the WAL.
+    """
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    file = f"seg_{int(ids[0]):010d}_{uuid.uuid4().hex[:8]}.faiss"
+    _replace_file(os.path.join(SEGMENTS_DIR, file), lambda path: faiss.write_index(index, path))
+    segment_id = chunk_store.commit_segment(file, ids, shard, replaces)
+    return Segment(segment_id, file, index, np.asarray(ids, dtype="int64"))
+
+def _group_by_doc(doc_names) -> Dict[Optional[str], np.ndarray]:
+    """Row positions of each document in a list of per-row document names, in first-seen order."""
+    groups = {}
+    for row, name in enumerate(doc_names):
+        groups.setdefault(name, []).append(row)
+    return {name: np.array(rows, dtype="int64") for name, rows in groups.items()}
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """One immutable generation of the index: each document's shard of segments. Never mutated once published."""
+    shards: Dict[Optional[str], Tuple[Segment, ...]]
+    generation: int
+    # Bumped only when the indexed content changes (uploads, deletes), not by merges
+    corpus_version: int = 0
+
+    @property
+    def segments(self) -> List[Segment]:
+        return [segment for segments in self.shards.values() for segment in segments]
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    @property
+    def dimension(self) -> Optional[int]:
+        segments = self.segments
+        return segments[0].index.d if segments else None
+
+    def vectors(self) -> np.ndarray:
+        """All indexed vectors, segment by segment."""
+        return np.vstack([segment.vectors() for segment in self.segments])
+
+
+class VectorStore:
+    """
+    Process-wide, memory-resident vector store. Readers search the current
+    snapshot without locking; writers are serialized and swap in a new one.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._chunks = None
+        self._write_lock = threading.Lock()
+        self._merge_thread = None
+        self._pool = None
+
+    def snapshot(self) -> IndexSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._write_lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+        return snapshot
+
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def _load(self) -> IndexSnapshot:
+        self._chunks = ChunkStore()
+        if os.path.exists(INDEX_PATH) and not self._chunks.segments():
+            _migrate_legacy_index(self._chunks)
+
+        unsharded = [(segment_id, file) for segment_id, file, shard in self._chunks.segments() if shard is None]
+        if unsharded:
+            self._reshard(unsharded)
+
+        shards = {}
+        for segment_id, file, shard in self._chunks.segments():
+            shards.setdefault(shard, []).append(_load_segment(segment_id, file))
+
+        # Replay vectors that were logged but never sealed into a segment (crash mid-upload)
+        ids, vectors, doc_names = self._chunks.pending_vectors()
+        if len(ids):
+            print(f"ℹ️ Replaying {len(ids)} vectors from the write-ahead log.")
+            tier = choose_tier(sum(segment.size for segments in shards.values() for segment in segments) + len(ids))
+            for name, rows in _group_by_doc(doc_names).items():
+                index = build_index(vectors[rows], ids[rows], tier)
+                shards.setdefault(name, []).append(_write_segment(self._chunks, index, ids[rows], name))
+
+        # Remove segment files that never made it into the manifest
+        referenced = {segment.file for segments in shards.values() for segment in segments}
+        if os.path.isdir(SEGMENTS_DIR):
+            for file in os.listdir(SEGMENTS_DIR):
+                if file not in referenced:
+                    os.remove(os.path.join(SEGMENTS_DIR, file))
+
+        return IndexSnapshot(
+            shards={name: tuple(segments) for name, segments in shards.items()},
+            generation=0
+        )
+
+    def _reshard(self, unsharded: List[Tuple[int, str]]):
+        """
+        Split segments written before per-document sharding into one segment
+        per document. Vectors whose chunk row is gone were deleted and are dropped.
+        """
+        segments = [_load_segment(segment_id, file) for segment_id, file in unsharded]
+        sharded = {shard for _, _, shard in self._chunks.segments() if shard is not None}
+        ids, vectors = self._gather(segments)
+
+        tier = choose_tier(len(ids))
+        todo = [(name, doc_ids) for name, doc_ids in self._chunks.doc_ids().items() if name not in sharded]
+        for n, (name, doc_ids) in enumerate(todo):
+            rows = np.flatnonzero(np.isin(ids, doc_ids))
+            # The old segments are unregistered together with the last document, so a crash
+            # midway just redoes the documents that are not sharded yet
+            replaces = [segment_id for segment_id, _ in unsharded] if n == len(todo) - 1 else ()
+            if len(rows):
+                _write_segment(self._chunks, build_index(vectors[rows], ids[rows], tier), ids[rows], name, replaces)
+            elif replaces:
+                self._chunks.drop_segments(replaces)
+        if not todo:
+            self._chunks.drop_segments(segment_id for segment_id, _ in unsharded)
+
+        if os.path.exists(TOMBSTONES_PATH):
+            os.remove(TOMBSTONES_PATH)
+        print(f"ℹ️ Split {len(segments)} shared segments into {len(todo)} per-document shards.")
+
+    def _gather(self, segments: List[Segment]) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, vectors) of some segments sorted by id, using the exact vectors where segments are compressed."""
+        ids = np.concatenate([segment.ids for segment in segments])
+        vectors = np.vstack([segment.vectors() for segment in segments])
+        order = np.argsort(ids)
+        ids, vectors = ids[order], vectors[order]
+        if any(segment.compressed for segment in segments):
+            # Rebuild from the exact vectors so quantization error does not compound across merges
+            exact = self._chunks.vectors(ids)
+            for row, chunk_id in enumerate(ids.tolist()):
+                if chunk_id in exact:
+                    vectors[row] = exact[chunk_id]
+        return ids, vectors
+
+    @property
+    def chunks(self) -> ChunkStore:
+        self.snapshot()
+        return self._chunks
+
+    @property
+    def generation(self) -> int:
+        return self.snapshot().generation
+
+    @property
+    def corpus_version(self) -> int:
+        return self.snapshot().corpus_version
+
+    def _search_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._write_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="vector-search")
+        return self._pool
+
+    def search(self, query_embedding, k: int = 12, doc_filter: Optional[str] = None,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[SearchHit]:
+        """
+        Return up to k hits from the current snapshot, nearest first, searching only
+        `doc_filter`'s shard if given. `nprobe` / `ef_search` override the IVF / HNSW defaults.
+        """
+        snapshot = self.snapshot()
+        query = np.asarray(query_embedding, dtype="float32").reshape(1, -1)
+
         if doc_filter:
-            # Simple substring match (original logic)
-            filtered_docs = [doc for doc in docs if doc_filter in str(doc)]
-            return index, filtered_docs
-        
-        return index, docs
-    except Exception as e:
-        print(f"Error loading FAISS index: {e}")
+            if doc_filter not in snapshot.shards:
+                return []
+            shards = [snapshot.shards[doc_filter]]
+        else:
+            shards = list(snapshot.shards.values())
+
+        final_k = k
+        reranking = RERANK_FACTOR > 1 and any(segment.compressed for segments in shards for segment in segments)
+        if reranking:
+            k = k * RERANK_FACTOR
+
+        def search_shards(group):
+            candidates = []
+            for segments in group:
+                for segment in segments:
+                    D, ids = segment.search(query, k, nprobe=nprobe, ef_search=ef_search)
+                    candidates.extend(zip(D.tolist(), ids.tolist()))
+            return heapq.nsmallest(k, candidates)
+
+        if len(shards) > 1 and SEARCH_THREADS > 1:
+            # One task per worker rather than per shard, so many small shards do not drown in task overhead
+            groups = [shards[i::SEARCH_THREADS] for i in range(min(SEARCH_THREADS, len(shards)))]
+            top = heapq.nsmallest(k, [hit for hits in self._search_pool().map(search_shards, groups) for hit in hits])
+        else:
+            top = search_shards(shards)
+
+        if reranking and top:
+            top = self._rerank(query, top, final_k)
+
+        # Only now touch chunk text, and only for the hits
+        rows = self._chunks.fetch(chunk_id for _, chunk_id in top)
+        return [
+            SearchHit(chunk_id, rows[chunk_id][0], distance, rows[chunk_id][1])
+            for distance, chunk_id in top
+            if chunk_id in rows
+        ]
+
+    def _rerank(self, query, candidates, k):
+        """Re-score (distance, id) candidates on exact vectors; ids without one keep their approximate distance."""
+        exact = self._chunks.vectors(chunk_id for _, chunk_id in candidates)
+        rescored = [(distance, chunk_id) for distance, chunk_id in candidates if chunk_id not in exact]
+        if exact:
+            D, ids = rerank(query, list(exact), np.vstack(list(exact.values())), len(exact))
+            rescored.extend(zip(D.tolist(), ids.tolist()))
+        return heapq.nsmallest(k, rescored)
+
+    def add_chunks(self, embeddings, chunks, metadata=None):
+        """Add a whole batch of embeddings and chunks as one new segment per document.
+
+        `embeddings` is an (n, dim) array-like aligned with the `chunks` list.
+        `metadata` is an optional list of dicts (doc_name, chunk, page, kind), one per chunk.
+        Returns the stable ids assigned to the new chunks.
+        """
+        if not chunks:
+            return []
+
+        vectors = np.ascontiguousarray(np.asarray(embeddings, dtype="float32").reshape(len(chunks), -1))
+        if metadata is None:
+            metadata = [None] * len(chunks)
+        if len(metadata) != len(chunks):
+            raise ValueError("metadata must have one entry per chunk")
+        metadata = [meta or metadata_from_text(chunk) for meta, chunk in zip(metadata, chunks)]
+
+        self.snapshot()
+        with self._write_lock:
+            current = self._snapshot
+            if current.dimension is not None and current.dimension != vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {current.dimension}")
+
+            # Log first: once this commits the upload survives a crash
+            ids = np.array(self._chunks.add(list(chunks), metadata, vectors), dtype="int64")
+
+            # The tier follows the size of the whole corpus, not of the document's shard
+            tier = choose_tier(current.ntotal + len(ids))
+            shards = dict(current.shards)
+            for name, rows in _group_by_doc([meta.get("doc_name") for meta in metadata]).items():
+                segment = _write_segment(self._chunks, build_index(vectors[rows], ids[rows], tier), ids[rows], name)
+                shards[name] = shards.get(name, ()) + (segment,)
+            self._snapshot = replace(current, shards=shards, generation=current.generation + 1,
+                                     corpus_version=current.corpus_version + 1)
+
+        self.merge_in_background()
+        return ids.tolist()
+
+    def delete_document(self, doc_name: str):
+        """
+        Drop a document's shard: its segments, chunk rows and WAL entries go in
+        one transaction and no other document's index is touched.
+        """
+        self.snapshot()
+        with self._write_lock:
+            current = self._snapshot
+            if doc_name not in current.shards:
+                print(f"⚠️ No indexed chunks found for {doc_name}.")
+                return
+
+            files = self._chunks.drop_shard(doc_name)
+            shards = dict(current.shards)
+            del shards[doc_name]
+            self._snapshot = replace(current, shards=shards, generation=current.generation + 1,
+                                     corpus_version=current.corpus_version + 1)
+
+        for file in files:
+            os.remove(os.path.join(SEGMENTS_DIR, file))
+        print(f"✅ Deleted vectors related to {doc_name} from index.")
+
+    def _pick_merge(self, snapshot: IndexSnapshot) -> Tuple[Optional[str], List[Segment]]:
+        """The shard to merge next and its smallest few segments, if any shard has too many."""
+        for name, segments in snapshot.shards.items():
+            if len(segments) > MAX_SEGMENTS:
+                return name, sorted(segments, key=lambda s: s.size)[:max(2, MERGE_FACTOR)]
         return None, []
 
+    def merge(self) -> bool:
+        """
+        Merge one batch of segments picked by _pick_merge into a single new
+        segment of the same shard. The new index is built without holding the
+        write lock; uploads and searches continue meanwhile.
+        Returns False if there was nothing to merge.
+        """
+        snapshot = self.snapshot()
+        shard, victims = self._pick_merge(snapshot)
+        if not victims:
+            return False
 
-def create_or_update_index(embedding, chunk, docs_param=None):
-    """Add a new embedding and chunk to the index"""
-    index, existing_docs = load_faiss_index()
-
-    if index is None:
-        # Create new index
-        dim = len(embedding)
-        index = faiss.IndexFlatL2(dim)
-        docs = []
-    else:
-        # Use existing docs
-        docs = existing_docs
-
-    # Add new embedding and chunk
-    index.add(np.array([embedding]).astype('float32'), np.array([len(docs)]))
-    docs.append(chunk)
-
-    # Save updated index
-    save_faiss_index(index, docs)
-    
-def delete_from_index(doc_name):
-    if not os.path.exists(INDEX_PATH) or not os.path.exists(DOCS_PATH):
-        print("⚠️ No index or docs found to delete from.")
-        return
+        ids, vectors = self._gather(victims)
+        # The tier is re-picked for the current corpus size, so segments written while the corpus
+        # was small get promoted to IVF/HNSW once it has grown past the threshold
+        index = build_index(vectors, ids, choose_tier(snapshot.ntotal))
 
-    index = faiss.read_index(INDEX_PATH)
+        with self._write_lock:
+            current = self._snapshot
+            victim_ids = {segment.segment_id for segment in victims}
+            # The shard may have been dropped while the merged index was being built
+            if not victim_ids <= {segment.segment_id for segment in current.shards.get(shard, ())}:
+                return False
+
+            merged = _write_segment(self._chunks, index, ids, shard, replaces=victim_ids)
+            shards = dict(current.shards)
+            shards[shard] = tuple(s for s in shards[shard] if s.segment_id not in victim_ids) + (merged,)
+            self._snapshot = replace(current, shards=shards, generation=current.generation + 1)
+
+        for segment in victims:
+            os.remove(os.path.join(SEGMENTS_DIR, segment.file))
+        print(f"✅ Merged {len(victims)} segments of {shard} ({len(ids)} vectors).")
+        return True
+
+    def merge_in_background(self):
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return
+        if not self._pick_merge(self.snapshot())[1]:
+            return
+
+        def run():
+            try:
+                while self.merge():
+                    pass
+            except Exception:
+                print("🔥 MERGE ERROR:", traceback.format_exc())
 
-    with open(DOCS_PATH, "rb") as f:
-        docs = pickle.load(f)
+        self._merge_thread = threading.Thread(target=run, name="vector-merge", daemon=True)
+        self._merge_thread.start()
 
-    # Create new filtered docs and index
-    new_docs = []
-    new_vectors = []
 
-    for i, doc_source in enumerate(docs):
-        if doc_name not in doc_source:
-            new_docs.append(doc_source)
-            vector = index.reconstruct(i)
-            new_vectors.append(vector)
+_store = VectorStore()
 
-    if new_vectors:
-        new_index = faiss.IndexFlatL2(index.d)
-        new_index.add(np.array(new_vectors).astype('float32'), np.arange(len(new_vectors)))
-        faiss.write_index(new_index, INDEX_PATH)
-    else:
-        # Save an empty index
-        new_index = faiss.IndexFlatL2(index.d)
-        faiss.write_index(new_index, INDEX_PATH)
+def get_vector_store() -> VectorStore:
+    return _store
 
-    with open(DOCS_PATH, "wb") as f:
-        pickle.dump(new_docs, f)
 
-    print(f"✅ Deleted vectors related to {doc_name} from index.")
\ No newline at end of file
+def add_chunks(embeddings, chunks, metadata=None):
+    """Add a whole batch of embeddings and chunks to the shared store."""
+    return _store.add_chunks(embeddings, chunks, metadata)
+
+def create_or_update_index(embedding, chunk, docs_param=None):
+    """Add a single embedding and chunk to the index (prefer add_chunks for bulk ingestion)"""
+    add_chunks([embedding], [chunk])
+
+def delete_from_index(doc_name):
+    _store.delete_document(doc_name)
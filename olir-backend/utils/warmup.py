@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+import traceback
+
+# Load the embedding model and the vector index in the background as soon as the server starts
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+_status = {
+    name: {"ready": False, "seconds": None, "error": None}
+    for name in ("embedder", "vector_store")
+}
+_thread = None
+
+
+def _warm_embedder():
+    from utils.embedder import get_model
+    # One real forward pass so the first request does not pay for lazy kernel initialisation
+    get_model().encode(["warm up"])
+
+def _warm_vector_store():
+    from utils.vector_store import get_vector_store
+    get_vector_store().snapshot()
+
+
+def warm_up():
+    """Load every heavy component, recording how long each took (or why it failed)."""
+    for name, load in (("vector_store", _warm_vector_store), ("embedder", _warm_embedder)):
+        start = time.perf_counter()
+        try:
+            load()
+            _status[name].update(ready=True, seconds=round(time.perf_counter() - start, 3))
+            print(f"✅ Warmed up {name} in {_status[name]['seconds']}s")
+        except Exception as e:
+            _status[name]["error"] = str(e)
+            print(f"🔥 WARM-UP ERROR ({name}):", traceback.format_exc())
+
+def start_warm_up():
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        _thread.start()
+
+
+def readiness() -> dict:
+    """Per-component status, also marking components that got loaded by a request before the warm-up reached them."""
+    from utils.embedder import is_model_loaded
+    from utils.vector_store import get_vector_store
+    _status["embedder"]["ready"] = _status["embedder"]["ready"] or is_model_loaded()
+    _status["vector_store"]["ready"] = _status["vector_store"]["ready"] or get_vector_store().is_loaded()
+    return {
+        "ready": all(component["ready"] for component in _status.values()),
+        "components": {name: dict(component) for name, component in _status.items()}
+    }
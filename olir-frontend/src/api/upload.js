@@ -2,24 +2,45 @@ import axios from "axios";
 
 const BASE_URL = "http://localhost:8000"; // Change to your backend URL in production
 
+// Give up waiting for a training job after this long (it keeps running on the server)
+const TRAINING_TIMEOUT_MS = 30 * 60 * 1000;
+const MAX_POLL_INTERVAL_MS = 10000;
+
+// Uploads are trained by a background job; poll it, less often as it runs on, until it has finished
+const waitForTraining = async (jobId) => {
+  const deadline = Date.now() + TRAINING_TIMEOUT_MS;
+  let interval = 1000;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, interval));
+    interval = Math.min(interval * 1.5, MAX_POLL_INTERVAL_MS);
+    const res = await axios.get(`${BASE_URL}/jobs/${jobId}`);
+    if (res.data.status === "completed") return res.data;
+    if (res.data.status === "failed") {
+      throw new Error(res.data.error || "Training failed");
+    }
+  }
+  throw new Error("Training is taking longer than expected; check the training history for its status");
+};
+
 export const uploadDocument = async (data) => {
+  let res;
   if (data.youtube_url) {
     // Send JSON to /upload-youtube
-    const res = await axios.post(
+    res = await axios.post(
       `${BASE_URL}/upload-youtube`,
       { youtube_url: data.youtube_url },
       { headers: { "Content-Type": "application/json" } }
     );
-    return res.data;
   } else {
     // File upload as before
     const formData = new FormData();
     formData.append('file', data);
-    const res = await axios.post(`${BASE_URL}/upload`, formData, {
+    res = await axios.post(`${BASE_URL}/upload`, formData, {
       headers: {
         "Content-Type": "multipart/form-data",
       },
     });
-    return res.data;
   }
+  const job = await waitForTraining(res.data.job_id);
+  return { ...res.data, job };
 };